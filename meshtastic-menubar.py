@@ -26,9 +26,14 @@ import datetime as dt
 
 ts = dt.datetime.now()
 import os
+import sys
 import json
-import meshtastic
-from yaml import load
+import shlex
+import time
+import threading
+from collections import deque
+from itertools import islice
+from yaml import load, YAMLError
 from sys import version as python_version
 
 try:
@@ -48,11 +53,36 @@ swiftbar_repo_url = "https://github.com/swiftbar/SwiftBar/"
 argos_repo_url = "https://github.com/p-e-w/argos"
 
 
-def load_icons(file: str = None):
-    """Load icons from file"""
+# icon names for 0 to 9 hops away, compiled into hops_icons
+HOPS_ICONS = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine")
 
-    # TODO will need to define required icon variable names if we expect to load alternate icons
-    return {
+# longest txt that fits in one meshtastic text packet
+TXT_MAX_BYTES = 200
+
+
+def read_pack(file: str, kind: type, problems: list):
+    """Read a yaml pack file. Returns None and notes a problem if it is missing, broken or the wrong shape."""
+
+    try:
+        with open(os.path.expanduser(file), "r", encoding="utf-8") as f:
+            pack = load(f.read(), Loader=Loader)
+    except (OSError, YAMLError) as e:
+        problems.append(f"pack {file}: {e}")
+        return None
+
+    if not isinstance(pack, kind):
+        problems.append(f"pack {file} must be a {'mapping' if kind is dict else 'list'}")
+        return None
+    return pack
+
+
+def load_icons(file: str = None, problems: list = None):
+    """Load icons, a pack file can replace any of them by name"""
+
+    if problems is None:
+        problems = []
+
+    icons = {
         "green": "🟢",
         "yellow": "🟡",
         "orange": "🟠",
@@ -87,6 +117,7 @@ def load_icons(file: str = None):
         "seven": "7️⃣",
         "eight": "8️⃣",
         "nine": "9️⃣",
+        "inbox": "📥",
         "globe_mesh": "🌐",
         "globe_america": "🌎",
         "compass": "🧭",
@@ -114,30 +145,59 @@ def load_icons(file: str = None):
         "spider": "🕷️",
     }
 
+    pack = read_pack(file, dict, problems) if file else None
+    for name, value in (pack or {}).items():
+        if name not in icons:
+            problems.append(f"icon pack has no icon named {name}")
+        elif not isinstance(value, str) or not value:
+            problems.append(f"icon {name} must be text")
+        else:
+            icons[name] = value
+
+    return icons
 
-def load_telemetry(file: str = None):
-    """Load telemetry types to send from a yaml file or json"""
 
-    # TODO what are valid telemetry types?
-    return [
-        "gps",
-        "battery",
-        "position",
-        "user",
-        "device",
-    ]
+def load_telemetry(file: str = None, problems: list = None):
+    """Load telemetry types to send, a pack file replaces the whole list"""
 
+    if problems is None:
+        problems = []
 
-def load_txts(file: str = None):
-    """Load txt messages to send from a yaml file or json"""
-    # TODO move this to optional txt pack that can be loaded without changing code
+    # every type a node can be asked for
+    telemetry = list(TELEMETRY_TYPES)
 
-    return [
+    pack = read_pack(file, list, problems) if file else None
+    if pack:
+        # only accept the ones we can name, the request command refuses anything else
+        telemetry = []
+        for telemetry_type in map(str, pack):
+            if telemetry_type in TELEMETRY_TYPES:
+                telemetry.append(telemetry_type)
+            else:
+                problems.append(f"unknown telemetry type {telemetry_type}, choose from {', '.join(TELEMETRY_TYPES)}")
+
+    return telemetry
+
+
+def clean_txt(txt) -> str:
+    """One line of text that fits in a packet, so it is safe in every menu and never needs escaping again"""
+
+    return " ".join(str(txt).split()).encode("utf-8")[:TXT_MAX_BYTES].decode("utf-8", errors="ignore")
+
+
+def load_txts(file: str = None, problems: list = None, icons: dict = None):
+    """Load txt messages to send, a pack file replaces the whole list. Cleaned once here rather than per menu."""
+
+    if problems is None:
+        problems = []
+    if icons is None:
+        icons = icon
+
+    txts = [
         "Greetings",
         "Hello world!",
         "Hooty hoo!",
         "Howdy",
-        # TODO nested apostrophes break shell, need function to escape on send
         "What up?",
         "New phone who dis?",
         "Good morning!",
@@ -153,14 +213,14 @@ def load_txts(file: str = None):
         "ROFL",
         # "WTF",
         # "SOS",
-        icon["wave"],
-        icon["thumbsup"],
-        icon["thumbsdown"],
-        icon["victory"],
-        icon["horns"],
-        icon["ok_hand"],
-        icon["prohibited"],
-        icon["one_hundred"],
+        icons["wave"],
+        icons["thumbsup"],
+        icons["thumbsdown"],
+        icons["victory"],
+        icons["horns"],
+        icons["ok_hand"],
+        icons["prohibited"],
+        icons["one_hundred"],
         "Eyes on",
         "Breakfast",
         "Brunch",
@@ -176,19 +236,114 @@ def load_txts(file: str = None):
         "Wine",
     ]
 
+    pack = read_pack(file, list, problems) if file else None
+    if pack:
+        txts = pack
+
+    # drop empty and repeated txts after cleaning
+    return list(dict.fromkeys(txt for txt in map(clean_txt, txts) if txt))
+
+
+# config keys limited to a few values, bitbar choices come from RENDERERS
+CONFIG_CHOICES = {
+    "connection": ("wifi", "ble", "serial"),
+}
+
+# keys a radios entry may set, everything but name is copied over the top level keys when it is selected
+RADIO_KEYS = ("name", "connection", "wifi_host", "ble_name", "serial_port", "use_https")
+
+# menus in their default order, views in the config file can reorder or drop them
+VIEWS = {
+    "menu": ("about", "refresh", "broadcast", "alerts", "runway", "inbox", "topology", "map", "device", "debug", "help"),
+    "node": ("heard", "user", "device", "position", "history", "packets", "comms"),
+}
+
 
 def load_config() -> dict:
-    """Returns dict with config paramaters. Sets defaults, then overrides with params from file."""
+    """Returns dict with config paramaters. Sets defaults, then overrides with params from file.
+
+    The validated result is cached next to the config file keyed on its mtime, so an unchanged file skips yaml.
+    """
 
     config = {
         "connection": "wifi",
         "wifi_host": "meshtastic.local",
+        "ble_name": None,
+        "serial_port": None,
+        "radio": None,
+        "radios": [],
+        "logging": {},
+        "views": {view: list(names) for view, names in VIEWS.items()},
         "use_https": False,
+        "use_wifi": False,
         "debug": False,
         "log_nodes_jsonl": "meshtastic-menubar-nodes.jsonl",
         "log_nodes_csv": "meshtastic-menubar-nodes.csv",
         "log_wifi_report": "meshtastic-menubar-wifi-report.json",
         "log_traceroute_log": "meshtastic-menubar-traceroute.log",
+        "log_commands": "meshtastic-menubar-commands.log",
+        "log_packets": "meshtastic-menubar-packets.jsonl",
+        "state_packet_stats": "meshtastic-menubar-packet-stats.json",
+        "packet_buffer": 1000,
+        "packet_flush": 100,
+        "listen_seconds": 0,
+        "state_messages": "meshtastic-menubar-messages.json",
+        "inbox_keep": 50,
+        "inbox_show": 10,
+        "state_topology": "meshtastic-menubar-topology.json",
+        "topology_max_age": 7 * 24 * 3600,
+        "traceroute_batch": 10,
+        "traceroute_interval": 30,
+        "traceroute_min_age": 6 * 3600,
+        "traceroute_deadline": 120,
+        "command_socket": "meshtastic-menubar.sock",
+        "command_timeout": 60,
+        "shm_snapshot": "meshtastic-menubar-snapshot.shm",
+        "shm_max_age": 300,
+        "state_snapshot": "meshtastic-menubar-snapshot.json",
+        "snapshot_max_age": 7 * 86400,
+        "state_poll": "meshtastic-menubar-poll.json",
+        "poll_duty_cycle": 0.02,
+        "poll_window": 3600,
+        "poll_airtime": 0.5,
+        "poll_fresh": 6 * 3600,
+        "poll_heard": 24 * 3600,
+        "poll_deadline": 600,
+        "poll_backoff_max": 900,
+        "poll_max_channel_utilization": 25,
+        "poll_max_air_utilization": 7,
+        "state_enrich": "meshtastic-menubar-enrich.json",
+        "enrich_workers": 4,
+        "enrich_batch": 8,
+        "enrich_deadline": 0,
+        "enrich_retry": 6 * 3600,
+        "state_geo": "meshtastic-menubar-geo.json",
+        "geo_precision": 7,
+        "geo_radius": 5000,
+        "geo_nearby_show": 20,
+        "state_map": "meshtastic-menubar-map.json",
+        "map_geojson": "meshtastic-menubar-map.geojson",
+        "map_html": "meshtastic-menubar-map.html",
+        "state_alerts": "meshtastic-menubar-alerts.json",
+        "state_history": "meshtastic-menubar-history.bin",
+        "history_size": 48,
+        "state_forecast": "meshtastic-menubar-forecast.json",
+        "forecast_window": 48 * 3600,
+        "forecast_min_span": 3 * 3600,
+        "forecast_charge_level": 2,
+        "forecast_charge_voltage": 0.05,
+        "forecast_empty_level": 0,
+        "forecast_empty_voltage": 3.3,
+        "forecast_show": 10,
+        "alert_keep": 100,
+        "alert_window": 24 * 3600,
+        "alert_debounce": 6 * 3600,
+        "alerts": [
+            {"field": "tier", "to": "red"},
+            {"field": "batteryLevel", "below": 20},
+            {"event": "new"},
+            {"event": "vanished"},
+        ],
         "log_dir": os.environ.get("HOME"),
         "bitbar": "xbar",
         "font_mono": "Menlo-Regular",
@@ -197,15 +352,43 @@ def load_config() -> dict:
         "meshtastic_p1": "--host",
         "meshtastic_p2": "meshtastic.local",
         "config_file": f"{os.environ.get('HOME')}/.meshtastic-menubar.yml",
-        # HACK to get the shell bar separators to work in xbar and swiftbar
-        "B": "|",
-        "SHELL": "shell",
+        "pack_icons": None,
+        "pack_telemetry": None,
+        "pack_txts": None,
+        "state_packs": "meshtastic-menubar-packs.json",
     }
 
-    if os.path.exists(config["config_file"]):
+    try:
+        stat = os.stat(config["config_file"])
+    except OSError:
+        stat = None
+
+    # editing the config file or upgrading this script both invalidate the cache
+    cache_file = f"{os.path.splitext(config['config_file'])[0]}.cache.json"
+    key = [VERSION, os.stat(__file__).st_mtime_ns, stat.st_mtime_ns, stat.st_size] if stat else None
+    if key:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return cached["config"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    defaults = config.copy()
+    problems = []
+
+    if stat:
         with open(config["config_file"], "r") as f:
             new_config = load(f.read(), Loader=Loader)
+        if isinstance(new_config, dict):
             config.update(new_config)
+        elif new_config is not None:
+            problems.append(f"{config['config_file']} is not a mapping")
+
+    problems += config_sections(config, defaults)
+    problems += validate_config(config, defaults)
+    config["config_errors"] = problems
 
     # Maybe http saves some battery because https uses more cpu
     if config.get("use_https"):
@@ -226,9 +409,186 @@ def load_config() -> dict:
             config["meshtastic_p1"] = "--port"
             config["meshtastic_p2"] = config.get("serial_port")
 
+    if key:
+        try:
+            with open(f"{cache_file}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"key": key, "config": config}, f, separators=(",", ":"))
+            os.replace(f"{cache_file}.tmp", cache_file)
+        except (OSError, TypeError, ValueError):
+            pass
+
     return config
 
 
+def config_sections(config: dict, defaults: dict) -> list[str]:
+    """Copy the logging section and the selected radio over the top level keys they stand for"""
+
+    problems = []
+
+    logging = config.get("logging")
+    if isinstance(logging, dict):
+        for name, value in logging.items():
+            # logging: {dir: /tmp, packets: false} is log_dir: /tmp and log_packets: false
+            key = f"log_{name}"
+            if key in defaults:
+                config[key] = value
+            else:
+                problems.append(f"unknown key logging.{name}")
+
+    radios = config.get("radios")
+    if not radios or not isinstance(radios, list):
+        return problems
+
+    radio = config.get("radio")
+    for entry in radios:
+        if not isinstance(entry, dict) or not entry.get("name"):
+            problems.append("radios entries need a name")
+            continue
+        if radio is None or entry["name"] == radio:
+            break
+    else:
+        problems.append(f"radio {radio} not found in radios")
+        return problems
+
+    for name, value in entry.items():
+        if name not in RADIO_KEYS:
+            problems.append(f"unknown key radios.{entry['name']}.{name}")
+        elif name != "name":
+            config[name] = value
+    config["radio"] = entry["name"]
+
+    return problems
+
+
+def validate_config(config: dict, defaults: dict) -> list[str]:
+    """Check each value against the type of its default and any choices.
+
+    A bad value falls back to its default so the menu still draws, the problems are returned to show in the menu.
+    """
+
+    problems = []
+    choices = {**CONFIG_CHOICES, "bitbar": tuple(RENDERERS)}
+
+    for key, value in config.items():
+        if key not in defaults:
+            problems.append(f"unknown key {key}")
+            continue
+
+        default = defaults[key]
+        match default:
+            case None:
+                ok = True
+            case bool():
+                ok = isinstance(value, bool)
+            case int():
+                # counts and sizes end up in ranges and arrays
+                ok = isinstance(value, int) and not isinstance(value, bool)
+            case float():
+                ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+            case str():
+                # file names can be turned off with false or null
+                ok = isinstance(value, str) or value is None or value is False
+            case _:
+                ok = isinstance(value, type(default))
+
+        if ok and key in choices and value not in choices[key]:
+            problems.append(f"{key} must be one of {', '.join(choices[key])}, not {value}")
+            config[key] = default
+        elif not ok:
+            problems.append(f"{key} must be {type(default).__name__}, not {type(value).__name__}")
+            config[key] = default
+
+    views = config["views"]
+    for view, names in views.items():
+        if view not in VIEWS or not isinstance(names, list):
+            problems.append(f"views.{view} must be a list in {', '.join(VIEWS)}")
+            views[view] = list(VIEWS.get(view, ()))
+            continue
+        for name in names:
+            if name not in VIEWS[view]:
+                problems.append(f"views.{view} has no {name}, choose from {', '.join(VIEWS[view])}")
+    # a view left out of the file keeps its default order
+    config["views"] = {
+        view: [name for name in views.get(view, names) if name in VIEWS[view]]
+        for view, names in defaults["views"].items()
+    }
+
+    # a bad rule is dropped so Alerts never compares against a value it cannot use
+    rules = []
+    for i, rule in enumerate(config["alerts"] or []):
+        if not isinstance(rule, dict):
+            problem = f"must be a mapping, not {type(rule).__name__}"
+        elif "event" in rule:
+            problem = None if rule["event"] in ALERT_EVENTS else f"event must be one of {', '.join(ALERT_EVENTS)}"
+        elif rule.get("field") not in ALERT_FIELDS:
+            problem = f"field must be one of {', '.join(ALERT_FIELDS)}"
+        elif not any(key in rule for key in ("to", "below", "above")):
+            problem = "needs to, below or above"
+        else:
+            problem = next(
+                (
+                    f"{key} must be a number, not {type(rule[key]).__name__}"
+                    for key in ("below", "above")
+                    if key in rule and (not isinstance(rule[key], (int, float)) or isinstance(rule[key], bool))
+                ),
+                None,
+            )
+        if problem:
+            problems.append(f"alerts.{i} {problem}")
+        else:
+            rules.append(rule)
+    config["alerts"] = rules
+
+    return problems
+
+
+def load_packs(config: dict) -> dict:
+    """Icon, telemetry and txt tables from the pack files in the config.
+
+    The compiled tables are saved to state_packs with the mtime of each pack file, so until one changes later runs
+    load them in a single read without parsing yaml.
+    """
+
+    files = [config.get("pack_icons"), config.get("pack_telemetry"), config.get("pack_txts")]
+    if not any(files):
+        packs = {"icon": icon, "hops": hops_icons, "telemetry": telemetry_types, "txts": txts}
+        prepare_renderers(packs)
+        return packs
+
+    key = [VERSION, os.stat(__file__).st_mtime_ns]
+    for file in files:
+        try:
+            stat = os.stat(os.path.expanduser(file))
+            key.append([file, stat.st_mtime_ns, stat.st_size])
+        except (OSError, TypeError):
+            key.append([file, None])
+
+    packs = load_state(config, "state_packs", {})
+    if packs.get("key") != key:
+        problems = []
+        icons = load_icons(files[0], problems)
+        packs = {
+            "key": key,
+            "icon": icons,
+            "hops": [icons[name] for name in HOPS_ICONS],
+            "telemetry": load_telemetry(files[1], problems),
+            "txts": load_txts(files[2], problems, icons),
+            "problems": problems,
+        }
+        save_state(config, "state_packs", packs)
+
+    config["config_errors"] = config["config_errors"] + packs["problems"]
+    prepare_renderers(packs)
+    return packs
+
+
+def prepare_renderers(packs: dict) -> None:
+    """Escape the txts and telemetry types for every backend, they are repeated under each node"""
+
+    for renderer in RENDERERS.values():
+        renderer.prepare(packs["txts"] + packs["telemetry"])
+
+
 def recursive_copy(obj: dict | list) -> dict:
     """Copy each record to a new `dict` but skip any keys named `raw` because they cannot be sesrialized to JSON"""
 
@@ -241,6 +601,22 @@ def recursive_copy(obj: dict | list) -> dict:
         return obj
 
 
+def copy_nodes(iface, copy=dict) -> dict | None:
+    """Copy iface.nodes from another thread than meshtastic's reader, which adds nodes while we iterate.
+
+    Tries a few times and returns None if the NodeDB never held still, copy is dict for the top level only or
+    recursive_copy for a copy that can be changed and serialized.
+    """
+
+    for _ in range(3):
+        try:
+            return copy(iface.nodes)
+        except RuntimeError:
+            # a node was added while we copied
+            continue
+    return None
+
+
 def seconds_to_dhms(seconds: int) -> tuple[int, int, int, int]:
     """Compute days, hours, minutes, seconds from total seconds"""
 
@@ -256,32 +632,187 @@ def seconds_to_dhms(seconds: int) -> tuple[int, int, int, int]:
     return days, hours, minutes, seconds
 
 
-def clean_string(dirty):
-    """Strip shell escape risks from string"""
+def menu_line(line: str, depth: int = 0) -> str:
+    """Build a bitbar menu line at variable depths"""
+    return "--" * depth + line
+
 
-    return (
-        dirty.replace("!", r"\!")
-        .replace("|", "_")
-        .replace("`", "_")
-        .replace("'", "_")
-        .replace('"', "_")
-        .replace("{", "_")
-        .replace("}", "_")
-        .replace("$", "_")
-        .replace("(", "_")
-        .replace(")", "_")
-        .replace("[", "_")
-        .replace("]", "_")
-        .replace("\n", "_")
-        .replace("\x0a", "_")
-        .replace("\x0c", "_")
-        .replace("\x0d", "_")
+def menu_item(title: str, depth: int = 0, **params):
+    """Add a line to the menu model. Params are href, font, color, image, refresh, terminal and command as an argv list."""
+    menu.append((depth, title, params))
+
+
+class MenuRenderer:
+    """Render the menu model for xbar.
+
+    Escaping is a translate() table per backend built once at import, one pass over each string instead of a
+    replace() per character. Commands are passed as argv params so titles and texts never reach a shell.
+    """
+
+    # a bar would start the params and a newline a new item
+    titles = str.maketrans({"|": "¦", "\n": " ", "\r": " ", "\x0c": " "})
+    values = str.maketrans({"\n": " ", "\r": " ", "\x0c": " "})
+    # values holding an apostrophe are double quoted, so they cannot hold a double quote as well
+    quoted = str.maketrans({"\n": " ", "\r": " ", "\x0c": " ", '"': "”"})
+    keys = {"image": "templateImage"}
+    # HACK bar separators between params to get shell params working in xbar and swiftbar
+    separator = " | "
+    # pack texts repeat under every node, so they are escaped once by prepare() and looked up here
+    ready_titles = {}
+    ready_values = {}
+
+    @classmethod
+    def prepare(cls, texts: list[str]) -> None:
+        """Escape the pack texts for this backend once, when the packs load"""
+
+        renderer = cls()
+        cls.ready_titles = {text: renderer.title(text) for text in texts}
+        cls.ready_values = {text: renderer.value(text) for text in texts}
+
+    def title(self, title: str) -> str:
+        return title.translate(self.titles)
+
+    def value(self, value: str) -> str:
+        if "'" in value:
+            return f'"{value.translate(self.quoted)}"'
+        return f"'{value.translate(self.values)}'"
+
+    def param(self, key: str, value) -> str:
+        if isinstance(value, bool):
+            return f"{key}={str(value).lower()}"
+        value = str(value)
+        return f"{key}={self.ready_values.get(value) or self.value(value)}"
+
+    def params(self, params: dict) -> list[str]:
+        out = []
+        for key, value in params.items():
+            if key == "command":
+                out.append(self.param("shell", value[0]))
+                out.extend(self.param(f"param{i}", param) for i, param in enumerate(value[1:], start=1))
+            else:
+                out.append(self.param(self.keys.get(key, key), value))
+        return out
+
+    def line(self, depth: int, title: str, params: dict) -> str:
+        if title != "---":
+            title = self.ready_titles.get(title) or self.title(title)
+        if params:
+            title += " | " + self.separator.join(self.params(params))
+        return menu_line(title, depth)
+
+    def render(self, items: list) -> str:
+        return "".join(self.line(*item) + "\n" for item in items)
+
+
+class SwiftbarRenderer(MenuRenderer):
+    """SwiftBar reads the same syntax as xbar"""
+
+
+class ArgosRenderer(MenuRenderer):
+    """Argos splits params like a shell, takes one bash= command line and renders titles as pango markup"""
+
+    titles = str.maketrans(
+        {"|": "¦", "\n": " ", "\r": " ", "\x0c": " ", "&": "&amp;", "<": "&lt;", ">": "&gt;"}
     )
+    # argos looks for the last bar to find the params, so none can be left in them
+    values = str.maketrans({"|": "¦", "\n": " ", "\r": " ", "\x0c": " "})
+    keys = {}
+    separator = " "
+
+    def value(self, value: str) -> str:
+        return shlex.quote(value.translate(self.values))
+
+    def params(self, params: dict) -> list[str]:
+        if "command" in params:
+            # shlex.join with each argument escaped on its own, so pack texts come ready made
+            bash = " ".join(self.ready_values.get(arg) or self.value(arg) for arg in params["command"])
+            params = {**params, "bash": bash}
+            del params["command"]
+        return super().params(params)
+
+
+class TextRenderer(MenuRenderer):
+    """Indented plain text for a terminal, params are dropped"""
+
+    titles = str.maketrans({"\n": " ", "\r": " ", "\x0c": " "})
+
+    def line(self, depth: int, title: str, params: dict) -> str:
+        return "  " * depth + (self.ready_titles.get(title) or self.title(title))
+
+
+class JsonRenderer(MenuRenderer):
+    """Nested JSON, each item holds its params and the items beneath it"""
+
+    def render(self, items: list) -> str:
+        if not items:
+            return ""
+
+        root = {"items": []}
+        # parents[depth] is the item that owns the next item at that depth
+        parents = [root]
+        for depth, title, params in items:
+            item = {"separator": True} if title == "---" else {"title": title, **params}
+            del parents[depth + 1 :]
+            parents[-1].setdefault("items", []).append(item)
+            parents.append(item)
+        return json.dumps(root["items"], ensure_ascii=False) + "\n"
+
+
+RENDERERS = {
+    "xbar": MenuRenderer,
+    "swiftbar": SwiftbarRenderer,
+    "argos": ArgosRenderer,
+    "text": TextRenderer,
+    "json": JsonRenderer,
+}
+
+
+def render_menu(output: str):
+    """Write the menu model to stdout for the chosen bar and start a new one"""
+
+    sys.stdout.write(RENDERERS.get(output, MenuRenderer)().render(menu))
+    menu.clear()
+
+
+def bench_render(config: dict, count: int = 1000):
+    """Build the node menus for a synthetic mesh and time each renderer over them"""
+
+    now = int(time.time())
+    nodes = {
+        f"!{i:08x}": {
+            "num": i,
+            "lastHeard": now - i * 60,
+            "snr": 5.25,
+            "hopsAway": i % 4,
+            "user": {
+                "id": f"!{i:08x}",
+                "longName": f"Node {i} | it's <mine>",
+                "shortName": f"N{i % 1000:03d}",
+                "hwModel": "TBEAM",
+                "role": "CLIENT",
+            },
+            "deviceMetrics": {
+                "batteryLevel": 80,
+                "voltage": 4.01,
+                "channelUtilization": 12.5,
+                "airUtilTx": 1.5,
+                "uptimeSeconds": 86400,
+            },
+            "position": {"latitude": 45 + i / 10000, "longitude": -122 - i / 10000, "altitude": 100},
+        }
+        for i in range(1, count + 1)
+    }
 
+    print_menu_nodes(nodes)
+    items = menu.copy()
+    menu.clear()
 
-def menu_line(line: str, depth: int = 0) -> str:
-    """Build a bitbar menu line at variable depths"""
-    return "--" * depth + line
+    print(f"{count} nodes, {len(items)} menu items")
+    for output, renderer in RENDERERS.items():
+        start = time.perf_counter()
+        text = renderer().render(items)
+        elapsed = time.perf_counter() - start
+        print(f"{output:<8} {elapsed * 1000:8.1f}ms {len(items) / elapsed:12,.0f} items/s {len(text):>10,} bytes")
 
 
 def print_menu_icon(menu_status: str = None, menu_icon: str = None):
@@ -291,169 +822,155 @@ def print_menu_icon(menu_status: str = None, menu_icon: str = None):
         # base64 encoded image of Meshtastic logo
         menu_icon = "iVBORw0KGgoAAAANSUhEUgAAADIAAAAcCAYAAAAjmez3AAAACXBIWXMAAA7DAAAOwwHHb6hkAAAAGXRFWHRTb2Z0d2FyZQB3d3cuaW5rc2NhcGUub3Jnm+48GgAAApZJREFUWIXtmE2ITWEYx38zjvFthiFfC5OFaCZFJE2RRCIlysJuFGUxiVkYiylFmWxYTBGbWY2PUhJlwyyFSPmIhOQrYyjEmOHeY3Hcuce5/zPnOfe8d6H86yzuvc/vef7nve857/O+8F8AjAJ2AzUZctQB1W7slK92wAfuA4tTsjXAOSAP9AEr3Vqzqwn4QXAjPjAIHACqjHxniPWBD8BM9zZHlgfcjhjxgTNGfgXwS/CXnDtN0CFh4i1Qb2DHA08EX7haKuBXagkwJAxsNPJdgg1fn4G5bi2XagzwQBQ/beTXEDzcYTb62QeuU+E32TFR9AUw2cDWAi8Fv4PgrRf9fo9j78NqBnKRYjlgtZHvptTsxT+/qek6ADS6sV7UBOCpMHLcyG8SbB8wIxRzUMTcAUZndh/SKVHkMTDOwE4D3gl+ayTOA26JuI7s9gOtpfSB/AksN/LnhbnumNiFwHdRa1l51ouqA14JI4eN/HbBvgamjMC0CeYRMDa9/aJ6RNJ72JrE2cDHCJsH1idw1UCvqHs0vf1Am0WyQWCRkb8i+C4j2wB8ibA5YJWRH9Z04L0w0m7kdwn2GTAxhYedIsdzYFKKHFwQSW4Q7D+S1IAezXLa9MvCx0kr3CLgb8B8Axs3vzvt3v/SLKA/kisPbEgC5wCfhJFWY+F9gn1ItjfOFpHzDTA1DqgCrgroGrbN0gL0GrC03DsI6azw1RMX3CqCrS21B9wUvKtVOW492xYNnAd8FYHWTU6HYF33Seso7TD6iWyPTwgj1m1nPaWDMEDQbriW6vmOhAM8YD/Fw4S0BwGNBP9AIfnezJa1wl34EEHHLJeEJuAuYu4ZVBiM3rjkjtRM0CYlHj95GQtV8iYKsh45/Xv6DTfbUnnkjAuSAAAAAElFTkSuQmCC"
 
-    if menu_status:
-        print(f"{menu_status} | templateImage='{menu_icon}'")
-    else:
-        print(f" | templateImage='{menu_icon}'")
+    menu_item(f"{menu_status}" if menu_status else "", image=menu_icon)
+    menu_item("---")
+
 
-    print("---")
+def set_menu_status(menu_status: str = None):
+    """Change the status text next to the icon once it is known, the icon is added first so a failed run still shows it"""
+
+    if menu and "image" in menu[0][2]:
+        depth, title, params = menu[0]
+        menu[0] = (depth, f"{menu_status}" if menu_status else "", params)
 
 
 def print_menu_bar(depth: int = 0):
     """Display Meshtastic Menubar submenu"""
-    print(menu_line(f"Meshtastic Menubar", depth))
+    menu_item(f"Meshtastic Menubar", depth)
 
 
 def print_menu_about(depth: int = 1):
     """Display About submenu"""
-    print(menu_line(f"{icon['waffle']} About", depth))
-    print(menu_line(f"Meshtastic Menubar | href={git_repo_url}", depth=depth + 1))
-    print(menu_line(f"Version: {VERSION} | href={git_zip_url}", depth=depth + 1))
+    menu_item(f"{icon['waffle']} About", depth)
+    menu_item("Meshtastic Menubar", depth + 1, href=git_repo_url)
+    menu_item(f"Version: {VERSION}", depth + 1, href=git_zip_url)
 
-    print(menu_line("---", depth=depth + 1))
+    menu_item("---", depth + 1)
 
-    print(menu_line("Built with:", depth=depth + 1))
-    print(
-        menu_line(f"Meshtastic Project | href={meshtastic_home_url}", depth=depth + 1)
-    )
-    print(menu_line(f"Meshtastic Python | href={meshtastic_repo_url}", depth=depth + 1))
-    print(menu_line(f"xbar (bitbar) | href={xbar_repo_url}", depth=depth + 1))
-    print(menu_line(f"Swiftbar | href={swiftbar_repo_url}", depth=depth + 1))
-    print(menu_line(f"Argos | href={argos_repo_url}", depth=depth + 1))
+    menu_item("Built with:", depth + 1)
+    menu_item("Meshtastic Project", depth + 1, href=meshtastic_home_url)
+    menu_item("Meshtastic Python", depth + 1, href=meshtastic_repo_url)
+    menu_item("xbar (bitbar)", depth + 1, href=xbar_repo_url)
+    menu_item("Swiftbar", depth + 1, href=swiftbar_repo_url)
+    menu_item("Argos", depth + 1, href=argos_repo_url)
 
 
 def print_menu_refresh(depth: int = 1):
     """Display Refresh submenu"""
-    print(menu_line("---", depth))
-    print(menu_line(f"{icon['refresh']} Refresh | refresh=true", depth))
+    menu_item("---", depth)
+    menu_item(f"{icon['refresh']} Refresh", depth, refresh=True)
+
+
+def menu_command(title: str, depth: int, *params: str):
+    """Add a menu line that runs one of our own commands, params are passed as argv so nothing needs shell escaping"""
+    menu_item(title, depth, command=[os.path.abspath(__file__), *params], terminal=False)
 
 
 def print_menu_broadcast(depth: int = 1):
     """Display node Broadcast submenu"""
-    print(menu_line(f"{icon['satellite']} Broadcast", depth))
+    menu_item(f"{icon['satellite']} Broadcast", depth)
 
     for txt in txts:
-        # TODO new machine has different setup than my build machine. zsh: command not found: meshtastic
-        # TODO i hate shell escaping in these apps
-        # "meshtastic.local" 'meshtastic' --port /dev/cu.usbserial-0001 --sendtext What up?
-        # zsh: no matches found: up?
-        print(
-            menu_line(
-                f"{txt} | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']} param3='--sendtext' {config['B']} param4='{txt}'",
-                depth=depth + 1,
-            )
-        )
+        menu_command(txt, depth + 1, "send", "^all", txt)
 
 
 def print_menu_device(depth: int = 1):
     """Display host Device submenu"""
 
-    print(menu_line(f"{icon['gear']} Device", depth))
-    print(
-        menu_line(
-            f"Reboot | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']}param3='--reboot'",
-            depth=depth + 1,
-        )
-    )
-    print(
-        menu_line(
-            f"Shutdown | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']}param3='--shutdown'",
-            depth=depth + 1,
-        )
+    menu_item(f"{icon['gear']} Device", depth)
+    menu_command("Reboot", depth + 1, "reboot")
+    menu_command("Shutdown", depth + 1, "shutdown")
+    menu_item(
+        "Tail logs",
+        depth + 1,
+        command=[config["meshtastic_bin"], config["meshtastic_p1"], config["meshtastic_p2"], "--noproto"],
+        terminal=True,
     )
-    print(
-        menu_line(
-            f"Tail logs | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']}param3='--noproto'",
-            depth=depth + 1,
-        )
+    menu_item(
+        "BLE Scan",
+        depth + 1,
+        command=[config["meshtastic_bin"], config["meshtastic_p1"], config["meshtastic_p2"], "--ble-scan"],
+        terminal=True,
     )
-    print(
-        menu_line(
-            f"BLE Scan | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']}param3='--ble-scan'",
-            depth=depth + 1,
-        )
+    menu_item(
+        "json Report",
+        depth + 1,
+        command=["open", f"{config['target_url']}/json/report"],
+        terminal=False,
     )
-    print(
-        menu_line(
-            f"json Report | {config['SHELL']}='open' {config['B']} terminal=false {config['B']} param1='{config['target_url']}/json/report'",
-            depth=depth + 1,
+    # menu commands run without a terminal, their outcomes go to log_commands
+    if config.get("log_commands"):
+        menu_item(
+            "Command log",
+            depth + 1,
+            command=["tail", "-n", "50", f"{config['log_dir']}/{config['log_commands']}"],
+            terminal=True,
         )
-    )
 
 
 def print_menu_debug(depth: int = 1):
     """Build and display Debug submenu"""
 
-    print(menu_line(f"{icon['exclaim']} Debug", depth))
+    menu_item(f"{icon['exclaim']} Debug", depth)
 
 
 def print_menu_environment(depth: int = 1):
     """Build and display Debug Nodelist submenu"""
 
-    print(menu_line("Environment", depth=depth))
+    menu_item("Environment", depth)
     for var in sorted(os.environ):
-        print(menu_line(f"{var}={os.environ[var]}", depth=depth + 1))
+        menu_item(f"{var}={os.environ[var]}", depth + 1)
 
 
 def print_menu_nodelist(nodelist: str, depth: int = 1):
     """Build and display Debug Nodelist submenu"""
 
-    print(menu_line("Node List", depth=depth))
+    menu_item("Node List", depth)
     for nodelist_node in nodelist:
-        print(menu_line(f"Node: {nodelist_node}", depth=depth + 1))
+        menu_item(f"Node: {nodelist_node}", depth + 1)
 
 
 def print_menu_config(config: str, depth: int = 1):
     """Build and display Configuration submenu"""
 
-    print(menu_line(f"Config", depth=depth))
-    print(
-        menu_line(
-            f"Edit Config File: {config['config_file']} | shell='vi' | terminal=true | param1={config['config_file']}",
-            depth=depth + 1,
-        )
+    menu_item(f"Config", depth)
+    menu_item(
+        f"Edit Config File: {config['config_file']}",
+        depth + 1,
+        command=["vi", config["config_file"]],
+        terminal=True,
     )
 
     for param in sorted(config):
-        print(menu_line(f"{param}={config[param]}", depth=depth + 1))
+        menu_item(f"{param}={config[param]}", depth + 1)
 
 
 def print_menu_versions(depth: int = 1):
     """Show package versions submenu"""
 
-    print(menu_line("Versions", depth))
-    print(menu_line(f"Python: {python_version}", depth=depth + 1))
-    print(
-        menu_line(
-            f"Meshtastic: {meshtastic.version.get_active_version()}", depth=depth + 1
-        )
-    )
+    # imported late like the interfaces so the menu code loads without meshtastic
+    import meshtastic.version
+
+    menu_item("Versions", depth)
+    menu_item(f"Python: {python_version}", depth + 1)
+    menu_item(f"Meshtastic: {meshtastic.version.get_active_version()}", depth + 1)
 
 
 def print_menu_help(depth: int = 1):
     """Show Help submenu"""
 
-    print(menu_line("---", depth))
-    print(menu_line(f"{icon['question']} Help", depth))
-
-    print(menu_line("🟢 Green nodes have been heard in past hour", depth=depth + 1))
-    print(menu_line("🟡 Yellow nodes three hours", depth=depth + 1))
-    print(menu_line("🟠 Orange 12 hours", depth=depth + 1))
-    print(menu_line("🔴 Red past three days", depth=depth + 1))
-    print(menu_line("🟣 Purple heard in past seven days", depth=depth + 1))
-    print(
-        menu_line(
-            "🔵 Blue nodes are ice cold, we haven't heard from them in over a week",
-            depth=depth + 1,
-        )
-    )
-    print(
-        menu_line(
-            "⚫ Black nodes were partially received without timestamp", depth=depth + 1
-        )
-    )
-    print(menu_line("---", depth=depth + 1))
-    print(menu_line(f"📚 RTFM | href='{git_repo_url}'", depth=depth + 1))
+    menu_item("---", depth)
+    menu_item(f"{icon['question']} Help", depth)
+
+    menu_item("🟢 Green nodes have been heard in past hour", depth + 1)
+    menu_item("🟡 Yellow nodes three hours", depth + 1)
+    menu_item("🟠 Orange 12 hours", depth + 1)
+    menu_item("🔴 Red past three days", depth + 1)
+    menu_item("🟣 Purple heard in past seven days", depth + 1)
+    menu_item("🔵 Blue nodes are ice cold, we haven't heard from them in over a week", depth + 1)
+    menu_item("⚫ Black nodes were partially received without timestamp", depth + 1)
+    menu_item("---", depth + 1)
+    menu_item("📚 RTFM", depth + 1, href=git_repo_url)
 
 
 def print_menu_node_heard(
@@ -466,168 +983,114 @@ def print_menu_node_heard(
     heard_last,
 ):
     """Display node Heard submenu"""
-    print(f"--{icon['satdish']} Heard")
-    print(f"--SNR: {n.get('snr')} | href='{config['target_url']}'")
-    print(f"--Hops away: {n.get('hopsAway')} | href='{config['target_url']}'")
-    print(f"--Last: {heard_str}| href='{config['target_url']}'")
-    print(f"--Seconds: {heard_ago_total_seconds}| href='{config['target_url']}'")
-    print(f"--DT: {heard_at_dt}| href='{config['target_url']}'")
-    # print(f"--Epoc: {heard_last}| href='{config['target_url']}'")
+    menu_item(f"{icon['satdish']} Heard", 1)
+    menu_item(f"SNR: {n.get('snr')}", 1, href=config["target_url"])
+    menu_item(f"Hops away: {n.get('hopsAway')}", 1, href=config["target_url"])
+    menu_item(f"Last: {heard_str}", 1, href=config["target_url"])
+    menu_item(f"Seconds: {heard_ago_total_seconds}", 1, href=config["target_url"])
+    menu_item(f"DT: {heard_at_dt}", 1, href=config["target_url"])
+    # menu_item(f"Epoc: {heard_last}", 1, href=config["target_url"])
 
 
-def print_menu_node_device(n):
+def print_menu_node_device(n, id: str = None, forecast: "Forecast" = None):
     """Display node Device submenu"""
     uptime = int(n["deviceMetrics"].get("uptimeSeconds", 0))
     uptime_days, uptime_hours, uptime_minutes, uptime_seconds = seconds_to_dhms(uptime)
 
-    print("-----")
-    print(f"--{icon['pager']} Device")
-
-    print(
-        f"--Battery: {n['deviceMetrics'].get('batteryLevel', None)}% | href='{config['target_url']}'"
-    )
-
-    print(
-        f"--Voltage: {n['deviceMetrics'].get('voltage', None)} | href='{config['target_url']}'"
-    )
-    print(
-        f"--Channel Util: {n['deviceMetrics'].get('channelUtilization')} | href='{config['target_url']}'"
-    )
-    print(
-        f"--Air Util: {n['deviceMetrics'].get('airUtilization')} | href='{config['target_url']}'"
+    menu_item("---", 1)
+    menu_item(f"{icon['pager']} Device", 1)
+
+    menu_item(f"Battery: {n['deviceMetrics'].get('batteryLevel', None)}%", 1, href=config["target_url"])
+    menu_item(f"Voltage: {n['deviceMetrics'].get('voltage', None)}", 1, href=config["target_url"])
+    menu_item(f"Channel Util: {n['deviceMetrics'].get('channelUtilization')}", 1, href=config["target_url"])
+    menu_item(f"Air Util: {n['deviceMetrics'].get('airUtilTx')}", 1, href=config["target_url"])
+    menu_item(
+        f"Uptime: {uptime_days}d {uptime_hours}h {uptime_minutes}m {uptime_seconds}s",
+        1,
+        href=config["target_url"],
     )
-    print(
-        f"--Uptime: {uptime_days}d {uptime_hours}h {uptime_minutes}m {uptime_seconds}s| href='{config['target_url']}'"
-    )
-    print(f"--Seconds: {uptime}| href='{config['target_url']}'")
+    menu_item(f"Seconds: {uptime}", 1, href=config["target_url"])
+    if forecast is not None:
+        menu_item(f"Runway: {forecast.status(id)}", 1, href=config["target_url"])
 
 
 def print_menu_node_user(n):
     """Display node User submenu"""
-    print("-----")
-    print(f"--{icon['ticket']} User")
-    # print(f"--Name: {n['user'].get('longName')} | href='{config['target_url']}'")
-    print(f"--Name: {clean_string(n['user'].get('longName'))} | href='{config['target_url']}'")
-    # print(f"--Short: {n['user'].get('shortName')} | href='{config['target_url']}'")
-    print(f"--Short: {clean_string(n['user'].get('shortName'))} | href='{config['target_url']}'")
-    # TODO really any of these could be tainted, this code just isn't safe to use
-    print(f"--Model: {n['user'].get('hwModel')} | href='{config['target_url']}'")
-    print(f"--Role: {n['user'].get('role')} | href='{config['target_url']}'")
-    print(f"--PK: {n['user'].get('publicKey')} | href='{config['target_url']}'")
-
-
-def print_menu_node_position(n):
+    menu_item("---", 1)
+    menu_item(f"{icon['ticket']} User", 1)
+    # names are escaped for the menu by the renderer
+    menu_item(f"Name: {n['user'].get('longName')}", 1, href=config["target_url"])
+    menu_item(f"Short: {n['user'].get('shortName')}", 1, href=config["target_url"])
+    menu_item(f"Model: {n['user'].get('hwModel')}", 1, href=config["target_url"])
+    menu_item(f"Role: {n['user'].get('role')}", 1, href=config["target_url"])
+    menu_item(f"PK: {n['user'].get('publicKey')}", 1, href=config["target_url"])
+
+
+def print_menu_node_position(n, id: str = None, geo: "GeoIndex" = None, nodes: dict = None):
     """Display node Position submenu"""
 
-    print("-----")
-    print(f"--{icon['globe_america']} Position")
+    latitude = n["position"].get("latitude")
+    longitude = n["position"].get("longitude")
+
+    menu_item("---", 1)
+    menu_item(f"{icon['globe_america']} Position", 1)
     # TODO copy latlon to buffer for copypasta when clicked
-    print(
-        f"--Latitude: {n['position'].get('latitude')} | href='{config['target_url']}'"
-    )
-    print(
-        f"--Longitude: {n['position'].get('longitude')} | href='{config['target_url']}'"
-    )
-    print(
-        f"--Altitude: {n['position'].get('altitude')} | href='{config['target_url']}'"
-    )
-    print(
-        f"--Source: {n['position'].get('locationSource')} | href='{config['target_url']}'"
-    )
+    menu_item(f"Latitude: {latitude}", 1, href=config["target_url"])
+    menu_item(f"Longitude: {longitude}", 1, href=config["target_url"])
+    menu_item(f"Altitude: {n['position'].get('altitude')}", 1, href=config["target_url"])
+    menu_item(f"Source: {n['position'].get('locationSource')}", 1, href=config["target_url"])
 
     if n["position"].get("time"):
         pos_time = n["position"].get("time")
-        print(
-            f"--Time: {dt.datetime.fromtimestamp(pos_time)} | href='{config['target_url']}'"
-        )
+        menu_item(f"Time: {dt.datetime.fromtimestamp(pos_time)}", 1, href=config["target_url"])
+
+    if geo is not None:
+        print_menu_node_nearby(id, geo, nodes)
 
     #
     # Maps submenu
     #
-    print("--Open In...")
-    print(
-        "----Open Street Maps | href='https://www.openstreetmap.org/?mlat={}&mlon={}'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
-    )
-    print(
-        "----Apple Maps | href='https://maps.apple.com/map?ll={},{}'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
-    )
-    print(
-        "----Waze | href='https://www.waze.com/ul?ll={}%2C{}&navigate=yes&zoom=17'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
-    )
-    print(
-        "----Google Maps | href='https://www.google.com/maps/search/?api=1&query={}%2C{}'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
-    )
-    print(
-        "----Google Drive | href='https://www.google.com/maps/dir/?api=1&origin=&destination={}%2C{}&travelmode=walking'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
+    menu_item("Open In...", 1)
+    menu_item("Open Street Maps", 2, href=f"https://www.openstreetmap.org/?mlat={latitude}&mlon={longitude}")
+    menu_item("Apple Maps", 2, href=f"https://maps.apple.com/map?ll={latitude},{longitude}")
+    menu_item("Waze", 2, href=f"https://www.waze.com/ul?ll={latitude}%2C{longitude}&navigate=yes&zoom=17")
+    menu_item("Google Maps", 2, href=f"https://www.google.com/maps/search/?api=1&query={latitude}%2C{longitude}")
+    menu_item(
+        "Google Drive",
+        2,
+        href=f"https://www.google.com/maps/dir/?api=1&origin=&destination={latitude}%2C{longitude}&travelmode=walking",
     )
 
     # NOTE 804.67 meters = 0.5 mile
-    print(
-        "----Free Map | href='https://www.freemaptools.com/radius-around-point.htm?lat={}&lng={}&r=804.67'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
-    )
-    print(
-        "----Bing Maps | href='https://bing.com/maps/default.aspx?cp={}~{}&lvl=14'".format(
-            n["position"].get("latitude"),
-            n["position"].get("longitude"),
-        )
+    menu_item(
+        "Free Map",
+        2,
+        href=f"https://www.freemaptools.com/radius-around-point.htm?lat={latitude}&lng={longitude}&r=804.67",
     )
+    menu_item("Bing Maps", 2, href=f"https://bing.com/maps/default.aspx?cp={latitude}~{longitude}&lvl=14")
 
 
 def print_menu_node_comms(node):
     """Display node Comms submenu"""
 
-    print("-----")
-    print(f"--{icon['satellite']} Comms")
-
-    # HACK the node id starts with ! which is being interpreted by the shell, need to escape them, vscode is eating this on save somehow https://github.com/swiftbar/SwiftBar/issues/308
-    if config["bitbar"] == "xbar":
-        node_escaped = node.replace("!", r"\!")
-    if config["bitbar"] == "swiftbar":
-        node_escaped = node
-    if config["bitbar"] == "argos":
-        # TODO unknown shell escape behavior in argos
-        node_escaped = node
-    if config["bitbar"] == "local":
-        node_escaped = node.replace("!", r"\!")
-
-    print(
-        f"--Traceroute | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']} param3='--traceroute' {config['B']} param4='{node_escaped}' {config['B']} param5='|' {config['B']} param6='tee {config['log_dir']}/{config['log_traceroute_log']}'"
-    )
+    menu_item("---", 1)
+    menu_item(f"{icon['satellite']} Comms", 1)
 
-    print("--Request")
-    print(
-        f"----Request position | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']} param3='--request-position' {config['B']} param4='--dest' {config['B']} param5='{node_escaped}'"
-    )
+    # NOTE pass the id without the ! so it never reaches a shell as history expansion https://github.com/swiftbar/SwiftBar/issues/308
+    dest = node.lstrip("!")
 
-    print("----Telemetry")
+    menu_command("Traceroute", 1, "traceroute", dest)
+
+    menu_item("Request", 1)
+    menu_command("Request position", 2, "position", dest)
+
+    menu_item("Telemetry", 2)
     for telemetry_type in telemetry_types:
-        print(
-            f"----{telemetry_type} | {config['SHELL']}='meshtastic' {config['B']} terminal=true {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']} param3='--request-telemetry' {config['B']} param4='{telemetry_type}' {config['B']} param5='--dest' {config['B']} param6='{node_escaped}' "
-        )
+        menu_command(telemetry_type, 2, "telemetry", dest, telemetry_type)
 
-    print(f"--Send text")
+    menu_item(f"Send text", 1)
     for txt in txts:
-        print(
-            f"----{txt} | terminal=true {config['B']} {config['SHELL']}='meshtastic' {config['B']} param1={config['meshtastic_p1']} {config['B']} param2={config['meshtastic_p2']} {config['B']} param3='--sendtext' {config['B']} param4='{txt}' {config['B']} param5='--dest' {config['B']} param6='{node_escaped}'"
-        )
+        menu_command(txt, 2, "send", dest, txt)
 
 
 def get_node_short_name(n):
@@ -641,34 +1104,44 @@ def get_node_short_name(n):
 def get_node_hops_icon(n):
     """Return an emoji based on hopsAway"""
 
-    match n.get("hopsAway"):
-        case 0:
-            return icon["zero"]
-        case 1:
-            return icon["one"]
-        case 2:
-            return icon["two"]
-        case 3:
-            return icon["three"]
-        case 4:
-            return icon["four"]
-        case 5:
-            return icon["five"]
-        case 6:
-            return icon["six"]
-        case 7:
-            return icon["seven"]
-        case 8:
-            return icon["eight"]
-        case 9:
-            return icon["nine"]
-        case _:
-            return icon["star"]
+    hops = n.get("hopsAway")
+    if type(hops) is int and 0 <= hops < len(hops_icons):
+        return hops_icons[hops]
+    return icon["star"]
+
+
+# heard colour tiers, the first whose limit in seconds since last heard is not reached yet, blue past them all
+HEARD_TIERS = (
+    # green if heard in last hour
+    ("green", 1 * 60 * 60),
+    # yellow if heard in last three hours
+    ("yellow", 3 * 60 * 60),
+    # orange if heard in last 12 hours
+    ("orange", 12 * 60 * 60),
+    # red if heard in last 3 days
+    ("red", 4 * 24 * 60 * 60),
+    # purple if heard in last week
+    ("purple", 8 * 24 * 60 * 60),
+)
+
+
+def heard_tier(heard_last=None) -> str:
+    """Name of the colour tier for a last heard time, icon packs map names to glyphs only when the menu is drawn"""
+
+    # black because we can't calculate time without it
+    if not heard_last:
+        return "black"
+
+    heard_ago_total_seconds = int((ts - dt.datetime.fromtimestamp(heard_last)).total_seconds())
+    for tier, limit in HEARD_TIERS:
+        if heard_ago_total_seconds < limit:
+            return tier
+    # blue is on ice because it's been over a week since we heard from them
+    return "blue"
 
 
 def calculate_heards(heard_last=None):
-    # if heard_last is None then black because we can't calculate time without it
-    status_icon = icon["black"]
+    status_icon = icon[heard_tier(heard_last)]
     heard_str = "Not Reported"
     heard_ago = None
     heard_ago_total_seconds = None
@@ -689,29 +1162,6 @@ def calculate_heards(heard_last=None):
                 f"heard_ago {heard_ago} = now {ts} - heard_at_dt {heard_at_dt} heard_ago_seconds {heard_ago_total_seconds}"
             )
 
-        # blue is on ice because it's been over a week since we heard from them
-        status_icon = icon["blue"]
-
-        # purple if heard in last week
-        if heard_days < 8:
-            status_icon = icon["purple"]
-
-        # red if heard in last 3 days
-        if heard_days < 4:
-            status_icon = icon["red"]
-
-        # orange if heard in last 12 hours 43200 sec
-        if heard_ago_total_seconds < (12 * 60 * 60):
-            status_icon = icon["orange"]
-
-        # yellow if heard in last three hours 10800 sec
-        if heard_ago_total_seconds < (3 * 60 * 60):
-            status_icon = icon["yellow"]
-
-        # green if heard in last hour 3600 sec
-        if heard_ago_total_seconds < (1 * 60 * 60):
-            status_icon = icon["green"]
-
         heard_str = f"{heard_days}d {heard_hours}h {heard_minutes}m {heard_seconds}s"
 
     return (
@@ -724,13 +1174,22 @@ def calculate_heards(heard_last=None):
     )
 
 
-def print_menu_nodes(nodes):
+def print_menu_nodes(
+    nodes,
+    packet_stats: dict = None,
+    geo: "GeoIndex" = None,
+    history: "History" = None,
+    forecast: "Forecast" = None,
+):
     """Display all Nodes and their submenus"""
 
+    if packet_stats is None:
+        packet_stats = {}
+
     # NOTE default lastHeard to zero because relayed nodes do not report and we need this to sort
     nodelist = sorted(nodes, reverse=True, key=lambda x: nodes[x].get("lastHeard", 0))
-    print("---")
-    print(f"Nodes: {len(nodelist)}")
+    menu_item("---")
+    menu_item(f"Nodes: {len(nodelist)}")
 
     first_node = True
     for id in nodelist:
@@ -750,51 +1209,43 @@ def print_menu_nodes(nodes):
         #
         if first_node:
             first_node = False
-            print(
-                f"{icon['globe_mesh']} {id} {icon['hash']} {clean_string(get_node_short_name(node))} | font={config['font_mono']}"
+            menu_item(
+                f"{icon['globe_mesh']} {id} {icon['hash']} {get_node_short_name(node)}",
+                font=config["font_mono"],
             )
         else:
-            print(
-                f"{status_icon} {id} {get_node_hops_icon(node)} {clean_string(get_node_short_name(node))} | font={config['font_mono']}"
+            menu_item(
+                f"{status_icon} {id} {get_node_hops_icon(node)} {get_node_short_name(node)}",
+                font=config["font_mono"],
             )
 
         #
-        # First submenu
-        #
-        # Heard submenu
-        #
-        print_menu_node_heard(
-            node,
-            status_icon,
-            heard_str,
-            heard_ago,
-            heard_ago_total_seconds,
-            heard_at_dt,
-            heard_last,
-        )
-
+        # submenus in the order of the node view, each only when the node has data for it
         #
-        # User submenu
-        #
-        if node.get("user"):
-            print_menu_node_user(node)
-
-        #
-        # Metrics menu
-        #
-        if node.get("deviceMetrics"):
-            print_menu_node_device(node)
-
-        #
-        # Position menu
-        #
-        if node.get("position"):
-            print_menu_node_position(node)
-
-        #
-        # Comms menu
-        #
-        print_menu_node_comms(id)
+        for view in config["views"]["node"]:
+            match view:
+                case "heard":
+                    print_menu_node_heard(
+                        node,
+                        status_icon,
+                        heard_str,
+                        heard_ago,
+                        heard_ago_total_seconds,
+                        heard_at_dt,
+                        heard_last,
+                    )
+                case "user" if node.get("user"):
+                    print_menu_node_user(node)
+                case "device" if node.get("deviceMetrics"):
+                    print_menu_node_device(node, id, forecast)
+                case "position" if node.get("position"):
+                    print_menu_node_position(node, id, geo, nodes)
+                case "history" if history is not None:
+                    print_menu_node_history(id, history)
+                case "packets" if packet_stats.get(id):
+                    print_menu_node_packets(packet_stats[id])
+                case "comms":
+                    print_menu_node_comms(id)
 
 
 def get_iface(config: dict, connection: str = "wifi"):
@@ -810,7 +1261,7 @@ def get_iface(config: dict, connection: str = "wifi"):
             hostname = config.get("wifi_host")
             iface = meshtastic.tcp_interface.TCPInterface(hostname=hostname)
         except Exception as e:
-            print(f"Exception connecting host: {config.get('wifi_host')} via Wifi: {e}")
+            menu_item(f"Exception connecting host: {config.get('wifi_host')} via Wifi: {e}")
             no_device = str(e)
             # TODO could be wrong or missing hostname but sometimes wifi just doesn't respond. Not sure is mdns, maybe try IP next time
             # Exception connecting via Wifi: [Errno 8] nodename nor servname provided, or not known
@@ -824,7 +1275,7 @@ def get_iface(config: dict, connection: str = "wifi"):
                 address=config.get("ble_name")
             )
         except Exception as e:
-            print(f"Exception connecting via Bluetooth: {e}")
+            menu_item(f"Exception connecting via Bluetooth: {e}")
             no_device = str(e)
 
     elif connection == "serial":
@@ -840,7 +1291,7 @@ def get_iface(config: dict, connection: str = "wifi"):
                         config.get("serial_port")
                     )
                 except Exception as e:
-                    print(f"Exception connecting via Serial: {e}")
+                    menu_item(f"Exception connecting via Serial: {e}")
                     no_device = str(e)
                     serial_fail = True
                     # TODO Exception connecting via Serial: [Errno 35] Could not exclusively lock port /dev/cu.usbserial-0001: [Errno 35] Resource temporarily unavailable
@@ -851,7 +1302,7 @@ def get_iface(config: dict, connection: str = "wifi"):
             serial_fail = True
 
         if serial_fail:
-            print(f"Serial device does not exist at: {config.get('serial_port')}")
+            menu_item(f"Serial device does not exist at: {config.get('serial_port')}")
             no_device = "No connection method set"
             print_menu_debug(depth=0)
             print_menu_environment(depth=1)
@@ -868,7 +1319,7 @@ def get_nodes(config: dict, iface) -> dict:
     try:
         nodes = recursive_copy(iface.nodes)
     except Exception as e:
-        print(f"Exception getting nodes via Wifi: {e}")
+        menu_item(f"Exception getting nodes via Wifi: {e}")
 
     return nodes
 
@@ -947,25 +1398,2296 @@ def log_nodes_jsonl(config: dict, nodes: dict) -> None:
         )
 
 
+def load_state(config: dict, name: str, default=None):
+    """Load a json state file from log_dir. Returns default if disabled, missing or unreadable."""
+
+    if not config.get(name):
+        return default
+
+    try:
+        with open(f"{config['log_dir']}/{config[name]}", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_state(config: dict, name: str, data) -> None:
+    """Write a json state file to log_dir, replacing atomically so readers never see half a file"""
+
+    if not config.get(name):
+        return
+
+    path = f"{config['log_dir']}/{config[name]}"
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(f"{path}.tmp", path)
+
+
+def compact_packet(packet: dict) -> dict:
+    """Reduce a received packet to the short keys we keep in the ring buffer and packet log"""
+
+    decoded = packet.get("decoded", {})
+    record = {
+        "t": packet.get("rxTime") or int(time.time()),
+        "id": packet.get("id"),
+        "from": packet.get("fromId") or f"!{packet.get('from', 0):08x}",
+        "to": packet.get("toId") or f"!{packet.get('to', 0):08x}",
+        "ch": packet.get("channel", 0),
+        "port": decoded.get("portnum", "ENCRYPTED"),
+        "snr": packet.get("rxSnr"),
+        "rssi": packet.get("rxRssi"),
+    }
+
+    if packet.get("hopStart") is not None and packet.get("hopLimit") is not None:
+        record["hops"] = packet["hopStart"] - packet["hopLimit"]
+    if packet.get("relayNode") is not None:
+        record["relay"] = packet["relayNode"]
+    if decoded.get("text") is not None:
+        record["text"] = decoded["text"]
+
+    # keep the decoded protobufs that are useful later, payload is raw bytes and cannot be serialized
+    for key in ("telemetry", "position", "user", "traceroute", "routing"):
+        if key in decoded:
+            record[key] = recursive_copy(decoded[key])
+    if decoded.get("requestId") is not None:
+        record["req"] = decoded["requestId"]
+
+    return record
+
+
+class PacketTap:
+    """Capture packets from the receive callbacks into a bounded ring buffer and keep per-node counters"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.packets = deque(maxlen=config["packet_buffer"])
+        self.pending = []
+        self.seen = deque(maxlen=config["packet_buffer"])
+        self.seen_ids = set()
+        self.stats = load_state(config, "state_packet_stats", {})
+        self.handlers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, handler) -> None:
+        """Call handler(record) for every captured packet, used by stores built on top of the tap.
+
+        Handlers run with the tap lock held, so whoever holds it can save or copy the stores while packets arrive.
+        """
+        self.handlers.append(handler)
+
+    def on_receive(self, packet, interface=None):
+        """pubsub listener for meshtastic.receive and all of its subtopics"""
+
+        record = compact_packet(packet)
+
+        with self.lock:
+            duplicate = self.count(record)
+            if not duplicate:
+                self.packets.append(record)
+                self.pending.append(record)
+                for handler in self.handlers:
+                    handler(record)
+            if len(self.pending) >= self.config["packet_flush"]:
+                self.flush()
+
+    def count(self, record: dict) -> bool:
+        """Update per-node counters incrementally, returns True if packet id was already seen via another relay"""
+
+        node = self.stats.setdefault(
+            str(record["from"]),
+            {"count": 0, "dupes": 0, "first": record["t"], "last": record["t"], "ports": {}, "relays": {}},
+        )
+
+        duplicate = record["id"] is not None and record["id"] in self.seen_ids
+        if duplicate:
+            node["dupes"] += 1
+        else:
+            if record["id"] is not None:
+                if len(self.seen) == self.seen.maxlen:
+                    self.seen_ids.discard(self.seen[0])
+                self.seen.append(record["id"])
+                self.seen_ids.add(record["id"])
+            node["count"] += 1
+            node["last"] = max(node["last"], record["t"])
+            node["ports"][record["port"]] = node["ports"].get(record["port"], 0) + 1
+
+        if record.get("relay") is not None:
+            relay = str(record["relay"])
+            node["relays"][relay] = node["relays"].get(relay, 0) + 1
+
+        return duplicate
+
+    def flush(self) -> None:
+        """Append pending packets to the packet log in one write and save counters"""
+
+        if self.pending and self.config.get("log_packets"):
+            with open(
+                f"{self.config['log_dir']}/{self.config['log_packets']}",
+                "a",
+                encoding="utf-8",
+            ) as f:
+                f.write(
+                    "".join(
+                        json.dumps(record, separators=(",", ":"), default=str) + "\n"
+                        for record in self.pending
+                    )
+                )
+        self.pending = []
+        save_state(self.config, "state_packet_stats", self.stats)
+
+    def close(self) -> None:
+        """Stop listening and flush whatever is left"""
+
+        from pubsub import pub
+
+        try:
+            pub.unsubscribe(self.on_receive, "meshtastic.receive")
+        except Exception:
+            pass
+        with self.lock:
+            self.flush()
+
+
+def packet_tap_start(config: dict) -> PacketTap:
+    """Subscribe a new PacketTap to the meshtastic receive callbacks. Call before connecting so nothing is missed."""
+
+    from pubsub import pub
+
+    tap = PacketTap(config)
+    pub.subscribe(tap.on_receive, "meshtastic.receive")
+    return tap
+
+
+def packet_rate(stats: dict) -> float:
+    """Packets per hour over the span we have been counting this node"""
+
+    span = max(stats["last"] - stats["first"], 3600)
+    return stats["count"] * 3600 / span
+
+
+def print_menu_node_packets(stats: dict):
+    """Display node Packets submenu"""
+
+    menu_item("---", 1)
+    menu_item(f"{icon['bars']} Packets", 1)
+    menu_item(f"Count: {stats['count']}", 1, href=config["target_url"])
+    menu_item(f"Rate: {packet_rate(stats):.1f}/h", 1, href=config["target_url"])
+    menu_item(f"Duplicates: {stats['dupes']}", 1, href=config["target_url"])
+    menu_item(f"Last: {dt.datetime.fromtimestamp(stats['last'])}", 1, href=config["target_url"])
+    menu_item("Ports", 1)
+    for port, count in sorted(stats["ports"].items(), key=lambda x: -x[1]):
+        menu_item(f"{port}: {count}", 2)
+    if stats["relays"]:
+        menu_item("Relays", 1)
+        for relay, count in sorted(stats["relays"].items(), key=lambda x: -x[1]):
+            menu_item(f"{int(relay):02x}: {count}", 2)
+
+
+class MessageStore:
+    """Recent text messages deduplicated by packet id and indexed by channel and sender"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.keep = config["inbox_keep"]
+        self.channels = {}
+        self.nodes = {}
+        self.ids = deque(maxlen=self.keep * 8)
+        self.id_set = set()
+        self.dirty = False
+
+        # replay the saved window oldest first so the indexes and id window rebuild in order
+        saved = load_state(config, "state_messages", [])
+        for message in saved:
+            self.index(message)
+
+    def index(self, message: dict) -> None:
+        """Add message to channel and sender windows, deques drop the oldest when full"""
+
+        if len(self.ids) == self.ids.maxlen:
+            self.id_set.discard(self.ids[0])
+        self.ids.append(message["id"])
+        self.id_set.add(message["id"])
+
+        self.channels.setdefault(message["ch"], deque(maxlen=self.keep)).append(message)
+        self.nodes.setdefault(message["from"], deque(maxlen=self.keep)).append(message)
+
+    def add(self, record: dict) -> None:
+        """PacketTap handler, keeps only text messages we have not already stored"""
+
+        if record["port"] != "TEXT_MESSAGE_APP" or record.get("text") is None:
+            return
+        if record["id"] is not None and record["id"] in self.id_set:
+            return
+
+        # direct messages get their own channel so they are not lost in the public chatter
+        channel = "DM" if str(record["to"]).startswith("!") else str(record["ch"])
+        self.index(
+            {
+                "id": record["id"],
+                "t": record["t"],
+                "from": record["from"],
+                "ch": channel,
+                "text": record["text"],
+            }
+        )
+        self.dirty = True
+
+    def save(self) -> None:
+        """Persist the recent window, each message once even though it is indexed twice"""
+
+        messages = {}
+        for window in self.channels.values():
+            for message in window:
+                messages[message["id"]] = message
+        for window in self.nodes.values():
+            for message in window:
+                messages[message["id"]] = message
+
+        save_state(self.config, "state_messages", sorted(messages.values(), key=lambda x: x["t"]))
+        self.dirty = False
+
+
+def message_line(message: dict) -> str:
+    """Format one message for the inbox"""
+
+    return f"{dt.datetime.fromtimestamp(message['t']):%m-%d %H:%M} {message['from']}: {message['text']}"
+
+
+def print_menu_inbox(store: MessageStore, nodes: dict, depth: int = 1):
+    """Display Inbox submenu with the last few messages per channel and per node"""
+
+    show = config["inbox_show"]
+
+    menu_item(f"{icon['inbox']} Inbox", depth)
+
+    if not store.channels:
+        menu_item("No messages", depth + 1)
+        return
+
+    menu_item("Channels", depth + 1)
+    for channel in sorted(store.channels):
+        label = "Direct" if channel == "DM" else f"Channel {channel}"
+        menu_item(label, depth + 2)
+        for message in islice(reversed(store.channels[channel]), show):
+            menu_item(message_line(message), depth + 3, font=config["font_mono"])
+
+    menu_item("Nodes", depth + 1)
+    for node in sorted(store.nodes, key=lambda x: -store.nodes[x][-1]["t"]):
+        name = get_node_short_name(nodes.get(node, {}))
+        menu_item(f"{node} - {name or ''}", depth + 2)
+        for message in islice(reversed(store.nodes[node]), show):
+            menu_item(message_line(message), depth + 3, font=config["font_mono"])
+
+
+def node_id(num) -> str:
+    """Convert a node number to the !hex id used as key in iface.nodes"""
+
+    if isinstance(num, str):
+        return num
+    return f"!{num:08x}"
+
+
+def parse_traceroute(record: dict) -> list[list[tuple[str, str, float | None]]]:
+    """Parse a traceroute reply into hop lists of (from, to, snr) towards the target and back to us.
+
+    The reply comes from the target to the origin, so only pass records that carry a requestId.
+    """
+
+    # SNR is reported in quarter dB and -128 means the hop did not report it
+    def snr(values, i):
+        if values is None or len(values) <= i or values[i] == -128:
+            return None
+        return values[i] / 4
+
+    route = record.get("traceroute", {})
+    origin = record["to"]
+    target = record["from"]
+    legs = []
+
+    towards = [origin] + [node_id(n) for n in route.get("route", [])] + [target]
+    snr_towards = route.get("snrTowards")
+    if snr_towards is not None and len(snr_towards) != len(towards) - 1:
+        snr_towards = None
+    legs.append([(towards[i], towards[i + 1], snr(snr_towards, i)) for i in range(len(towards) - 1)])
+
+    # back route is only valid when the reply carried hopStart and one snr per hop
+    back = [target] + [node_id(n) for n in route.get("routeBack", [])] + [origin]
+    snr_back = route.get("snrBack")
+    if "hops" in record and snr_back is not None and len(snr_back) == len(back) - 1:
+        legs.append([(back[i], back[i + 1], snr(snr_back, i)) for i in range(len(back) - 1)])
+
+    return legs
+
+
+class Topology:
+    """Mesh topology from traceroutes. Directed adjacency list with last seen time and smoothed SNR per link."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        state = load_state(config, "state_topology", {})
+        self.edges = state.get("edges", {})
+        self.routes = state.get("routes", {})
+        self.dirty = False
+        self.prune()
+
+    def add(self, record: dict) -> None:
+        """PacketTap handler, merges traceroute replies into the graph.
+
+        Only replies carry a requestId, requests to us or overheard in transit run the other way and would be merged backwards.
+        """
+
+        if record["port"] != "TRACEROUTE_APP" or "traceroute" not in record or record.get("req") is None:
+            return
+        self.merge(record["t"], parse_traceroute(record))
+
+    def merge(self, t: int, legs: list) -> None:
+        """Merge parsed hop lists, link quality is an exponential moving average of SNR"""
+
+        for hops in legs:
+            for a, b, snr in hops:
+                edge = self.edges.setdefault(a, {}).setdefault(b, {"snr": snr, "seen": t, "count": 0})
+                if snr is not None:
+                    edge["snr"] = snr if edge["snr"] is None else round(0.5 * edge["snr"] + 0.5 * snr, 2)
+                edge["seen"] = max(edge["seen"], t)
+                edge["count"] += 1
+
+        # remember the latest path to each target to answer who relays for whom
+        towards = legs[0]
+        self.routes[towards[-1][1]] = {
+            "t": t,
+            "origin": towards[0][0],
+            "path": [hop[1] for hop in towards[:-1]],
+        }
+        self.dirty = True
+
+    def fresh(self, edge: dict) -> bool:
+        """Links older than topology_max_age are ignored by queries"""
+        return time.time() - edge["seen"] < self.config["topology_max_age"]
+
+    def shortest_path(self, source: str, target: str) -> list[str] | None:
+        """Dijkstra over fresh links, one per hop with a small penalty for weak SNR"""
+
+        import heapq
+
+        queue = [(0.0, source, [source])]
+        done = set()
+        while queue:
+            cost, node, path = heapq.heappop(queue)
+            if node == target:
+                return path
+            if node in done:
+                continue
+            done.add(node)
+            for neighbour, edge in self.edges.get(node, {}).items():
+                if neighbour in done or not self.fresh(edge):
+                    continue
+                penalty = 0 if edge["snr"] is None else max(0.0, 10 - edge["snr"]) / 100
+                heapq.heappush(queue, (cost + 1 + penalty, neighbour, path + [neighbour]))
+        return None
+
+    def relays(self) -> dict[str, list[str]]:
+        """Return relay node -> targets whose latest traced path goes through it"""
+
+        relays = {}
+        for target, route in self.routes.items():
+            for relay in route["path"]:
+                relays.setdefault(relay, []).append(target)
+        return relays
+
+    def prune(self) -> None:
+        """Forget links and routes older than topology_max_age, so relays age out like the links they were traced over"""
+
+        cutoff = time.time() - self.config["topology_max_age"]
+        self.edges = {
+            a: fresh
+            for a, neighbours in self.edges.items()
+            if (fresh := {b: edge for b, edge in neighbours.items() if edge["seen"] > cutoff})
+        }
+        self.routes = {target: route for target, route in self.routes.items() if route["t"] > cutoff}
+
+    def save(self) -> None:
+        self.prune()
+        save_state(self.config, "state_topology", {"edges": self.edges, "routes": self.routes})
+        self.dirty = False
+
+
+def print_menu_topology(topology: Topology, nodes: dict, depth: int = 1):
+    """Display Topology submenu with traced paths and relays"""
+
+    def name(id):
+        return f"{id} {get_node_short_name(nodes.get(id, {})) or ''}".strip()
+
+    links = sum(len(neighbours) for neighbours in topology.edges.values())
+
+    menu_item(f"{icon['globe_mesh']} Topology", depth)
+    menu_item(f"Links: {links}", depth + 1)
+    menu_command("Traceroute batch", depth + 1, "traceroute")
+
+    menu_item("Routes", depth + 1)
+    for target in sorted(topology.routes, key=lambda x: -topology.routes[x]["t"]):
+        route = topology.routes[target]
+        path = topology.shortest_path(route["origin"], target) or [route["origin"]] + route["path"] + [target]
+        menu_item(f"{name(target)} ({len(path) - 1} hops)", depth + 2)
+        for a, b in zip(path, path[1:]):
+            snr = topology.edges.get(a, {}).get(b, {}).get("snr")
+            menu_item(f"{name(a)} > {name(b)} SNR: {snr}", depth + 3, font=config["font_mono"])
+
+    menu_item("Relays", depth + 1)
+    for relay, targets in sorted(topology.relays().items(), key=lambda x: -len(x[1])):
+        menu_item(f"{name(relay)} relays for {len(targets)}", depth + 2)
+        for target in targets:
+            menu_item(name(target), depth + 3)
+
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS = 6371008.8
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    """Encode a position as a geohash, nearby positions share a prefix"""
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            middle = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= middle:
+                value = value * 2 + 1
+                lon_range[0] = middle
+            else:
+                value = value * 2
+                lon_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= middle:
+                value = value * 2 + 1
+                lat_range[0] = middle
+            else:
+                value = value * 2
+                lat_range[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+
+    return "".join(chars)
+
+
+def haversine_from(latitude: float, longitude: float, points: list[tuple[float, float]]) -> list[tuple[float, float]]:
+    """Distance in meters and initial bearing in degrees from one position to many, origin terms computed once"""
+
+    from math import radians, degrees, sin, cos, asin, atan2, sqrt
+
+    lat1 = radians(latitude)
+    lon1 = radians(longitude)
+    cos_lat1 = cos(lat1)
+    sin_lat1 = sin(lat1)
+
+    results = []
+    for lat, lon in points:
+        lat2 = radians(lat)
+        dlon = radians(lon) - lon1
+        cos_lat2 = cos(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * sin(dlon / 2) ** 2
+        distance = 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
+        bearing = degrees(atan2(sin(dlon) * cos_lat2, cos_lat1 * sin(lat2) - sin_lat1 * cos_lat2 * cos(dlon)))
+        results.append((distance, (bearing + 360) % 360))
+    return results
+
+
+def compass(bearing: float) -> str:
+    """Eight point compass direction for a bearing"""
+    return ("N", "NE", "E", "SE", "S", "SW", "W", "NW")[int((bearing + 22.5) % 360 // 45)]
+
+
+def distance_str(meters: float) -> str:
+    if meters < 1000:
+        return f"{meters:.0f} m"
+    return f"{meters / 1000:.1f} km"
+
+
+class GeoIndex:
+    """Geohash index of node positions with distance and bearing from our node, updated only for nodes that moved.
+
+    Each node's nearby list is cached and only searched again when a position in the cells around it changed.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.precision = config["geo_precision"]
+        state = load_state(config, "state_geo", {})
+        if state.get("precision") != self.precision:
+            state = {}
+        self.positions = state.get("positions", {})
+        self.origin = state.get("origin")
+        self.distances = state.get("distances", {})
+        self.near = state.get("near", {})
+        if state.get("near_for") != [config["geo_radius"], config["geo_nearby_show"]]:
+            self.near = {}
+        self.me = None
+
+        # size of one geohash cell at this precision, cells are looked up by column and row so neighbours are
+        # found by counting rather than encoding a geohash for each
+        lon_bits = (5 * self.precision + 1) // 2
+        lat_bits = 5 * self.precision // 2
+        self.dlat = 180 / 2**lat_bits
+        self.dlon = 360 / 2**lon_bits
+        self.cells = {}
+        for id, (lat, lon, cell) in self.positions.items():
+            self.cells.setdefault(self.grid(lat, lon), set()).add(id)
+        self.dirty = False
+
+    def grid(self, latitude: float, longitude: float) -> tuple[int, int]:
+        """Column and row of the geohash cell holding a position"""
+        return int((longitude + 180) // self.dlon), int((latitude + 90) // self.dlat)
+
+    def update(self, nodes: dict, me: str = None) -> None:
+        """Re-index nodes whose position changed and forget nodes no longer in nodes, fixing up the nearby lists
+        around each of them, then compute distances from us in one batch"""
+
+        self.me = me
+        changed = []
+        for id, node in nodes.items():
+            position = node.get("position") or {}
+            lat = position.get("latitude")
+            lon = position.get("longitude")
+            if lat is None or lon is None:
+                continue
+            old = self.positions.get(id)
+            if old and old[0] == lat and old[1] == lon:
+                continue
+
+            if old:
+                self.uncell(id, old)
+            self.positions[id] = [lat, lon, geohash(lat, lon, self.precision)]
+            self.cells.setdefault(self.grid(lat, lon), set()).add(id)
+            changed.append(id)
+            self.moved(id, old)
+
+        # nodes the NodeDB dropped would otherwise stay in the index and state_geo forever
+        for id in [id for id in self.positions if id not in nodes]:
+            old = self.positions.pop(id)
+            self.uncell(id, old)
+            self.distances.pop(id, None)
+            self.moved(id, old)
+            self.dirty = True
+
+        if me in self.positions and self.positions[me][:2] != self.origin:
+            # we moved so every distance is stale
+            self.origin = self.positions[me][:2]
+            changed = list(self.positions)
+
+        if changed and self.origin:
+            points = [self.positions[id][:2] for id in changed]
+            for id, result in zip(changed, haversine_from(*self.origin, points)):
+                self.distances[id] = result
+
+        for id in self.positions:
+            if id not in self.near:
+                self.near[id] = self.search(id)
+
+        if changed:
+            self.dirty = True
+
+    def moved(self, id: str, old: list | None) -> None:
+        """Fix up the cached nearby lists of the nodes within geo_radius of where node id was and is now.
+
+        A list is only searched again when it was full and node id left it for somewhere further than the rest.
+        """
+
+        from bisect import insort
+
+        keep = self.config["geo_nearby_show"] + 1
+        new = self.positions.get(id)
+        self.near.pop(id, None)
+        # nothing to fix up on the first run, every list is searched after the update
+        if not self.near:
+            return
+
+        neighbours = set()
+        for lat, lon, cell in filter(None, (old, new)):
+            for cells, reach in self.around(lat, lon):
+                for cell in cells:
+                    neighbours.update(self.cells.get(cell, ()))
+        neighbours = [other for other in neighbours if other in self.near and other != id]
+        if not neighbours:
+            return
+
+        distances = [None] * len(neighbours)
+        if new is not None:
+            points = [self.positions[other][:2] for other in neighbours]
+            distances = [distance for distance, bearing in haversine_from(new[0], new[1], points)]
+
+        for other, distance in zip(neighbours, distances):
+            near = self.near[other]
+            left = [entry for entry in near if entry[1] != id]
+            close = distance is not None and distance <= self.config["geo_radius"]
+            if close:
+                distance = round(distance, 1)
+            if len(left) < len(near) and len(near) >= keep and not (close and left and distance <= left[-1][0]):
+                # id left a full list for somewhere further than the rest, a node outside it may now be closer
+                self.near[other] = self.search(other)
+                continue
+            if close:
+                insort(left, [distance, id])
+            self.near[other] = left[:keep]
+
+    def uncell(self, id: str, position: list) -> None:
+        cell = self.grid(*position[:2])
+        self.cells[cell].discard(id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def around(self, latitude: float, longitude: float):
+        """Yield (cells, reach) one ring at a time outwards from the cell of a position until the rings cover geo_radius.
+
+        Every node further out than the cells yielded so far is at least reach meters away.
+        """
+
+        from math import cos, radians, ceil
+
+        size = min(self.dlat * 111320, self.dlon * 111320 * max(cos(radians(latitude)), 0.01))
+        rings = ceil(self.config["geo_radius"] / size)
+        x, y = self.grid(latitude, longitude)
+
+        for ring in range(rings + 1):
+            if 8 * ring > len(self.cells):
+                # a sparse mesh has fewer occupied cells than the rest of the rings, pick those out directly
+                yield [cell for cell in self.cells if ring <= max(abs(cell[0] - x), abs(cell[1] - y)) <= rings], rings * size
+                return
+            if ring == 0:
+                yield [(x, y)], 0
+                continue
+            cells = [(x + i, y + j) for i in range(-ring, ring + 1) for j in (-ring, ring)]
+            cells += [(x + i, y + j) for i in (-ring, ring) for j in range(1 - ring, ring)]
+            yield cells, ring * size
+
+    def search(self, id: str) -> list[list[float, str]]:
+        """Closest geo_nearby_show nodes within geo_radius of node id plus one more if there are more.
+
+        Searches one ring of cells at a time and stops once the list can no longer change.
+        """
+
+        import heapq
+
+        lat, lon, cell = self.positions[id]
+        radius = self.config["geo_radius"]
+        keep = self.config["geo_nearby_show"] + 1
+        found = []
+        for cells, reach in self.around(lat, lon):
+            # nodes sharing a position, the firmware rounds positions to a grid, are measured once
+            spots = {}
+            for cell in cells:
+                for other in self.cells.get(cell, ()):
+                    if other != id:
+                        spots.setdefault(tuple(self.positions[other][:2]), []).append(other)
+            for others, (distance, bearing) in zip(spots.values(), haversine_from(lat, lon, list(spots))):
+                if distance <= radius:
+                    found.extend([round(distance, 1), other] for other in others)
+            if sum(1 for distance, other in found if distance <= reach) >= keep:
+                break
+        return heapq.nsmallest(keep, found)
+
+    def nearby(self, id: str) -> list[list[float, str]]:
+        """Nodes within geo_radius meters of node id, closest first, at most geo_nearby_show plus one"""
+        return self.near.get(id, [])
+
+    def save(self) -> None:
+        save_state(
+            self.config,
+            "state_geo",
+            {
+                "precision": self.precision,
+                "origin": self.origin,
+                "positions": self.positions,
+                "distances": self.distances,
+                "near_for": [self.config["geo_radius"], self.config["geo_nearby_show"]],
+                "near": self.near,
+            },
+        )
+        self.dirty = False
+
+
+def print_menu_node_nearby(id: str, geo: GeoIndex, nodes: dict):
+    """Display distance from our node and Nearby nodes in the Position submenu"""
+
+    if id in geo.distances and id != geo.me:
+        distance, bearing = geo.distances[id]
+        menu_item(
+            f"Distance: {distance_str(distance)} {compass(bearing)} ({bearing:.0f}°)",
+            1,
+            href=config["target_url"],
+        )
+
+    nearby = geo.nearby(id)
+    count = f"{config['geo_nearby_show']}+" if len(nearby) > config["geo_nearby_show"] else len(nearby)
+    menu_item(f"Nearby: {count} within {distance_str(config['geo_radius'])}", 1)
+    for distance, other in nearby[: config["geo_nearby_show"]]:
+        menu_item(
+            f"{distance_str(distance)} {other} {get_node_short_name(nodes.get(other, {})) or ''}",
+            2,
+            font=config["font_mono"],
+        )
+
+
+# fields sampled into each node's history, deviceMetrics except snr and hopsAway
+HISTORY_FIELDS = ("snr", "hopsAway", "batteryLevel", "voltage", "channelUtilization", "airUtilTx")
+HISTORY_LABELS = ("SNR", "Hops", "Battery", "Voltage", "Channel Util", "Air Util")
+SPARKS = "▁▂▃▄▅▆▇█"
+
+
+class History:
+    """Last history_size samples of HISTORY_FIELDS per node in fixed size ring buffers.
+
+    Each node holds one array of sample times and one array of values, one slot per sample and field, so memory
+    per node is fixed and adding a sample is O(1). Persisted as a single binary file.
+    """
+
+    MAGIC = b"MMH1"
+
+    def __init__(self, config: dict):
+        from array import array
+
+        self.config = config
+        self.size = config["history_size"]
+        self.empty_times = array("I", [0] * self.size)
+        self.empty_values = array("f", [float("nan")] * (self.size * len(HISTORY_FIELDS)))
+        self.nodes = {}
+        self.dirty = False
+        self.load()
+
+    def path(self) -> str:
+        return f"{self.config['log_dir']}/{self.config['state_history']}"
+
+    def load(self) -> None:
+        """Read the binary file, start over if it is missing or was written with another size"""
+
+        import struct
+        from array import array
+
+        if not self.config.get("state_history"):
+            return
+        try:
+            with open(self.path(), "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+
+        header = struct.Struct("<4sII")
+        record = struct.Struct("<9sII")
+        if len(data) < header.size or header.unpack_from(data) != (self.MAGIC, self.size, len(HISTORY_FIELDS)):
+            return
+
+        times_size = self.size * 4
+        values_size = self.size * len(HISTORY_FIELDS) * 4
+        offset = header.size
+        while offset + record.size + times_size + values_size <= len(data):
+            id, head, count = record.unpack_from(data, offset)
+            offset += record.size
+            times = array("I", data[offset : offset + times_size])
+            offset += times_size
+            values = array("f", data[offset : offset + values_size])
+            offset += values_size
+            self.nodes[id.decode("ascii")] = [head, count, times, values]
+
+    def add(self, id: str, t: int, sample: dict) -> None:
+        """Write one sample into the next slot of the node's ring, overwriting the oldest when full"""
+
+        node = self.nodes.get(id)
+        if node is None:
+            node = self.nodes[id] = [0, 0, self.empty_times[:], self.empty_values[:]]
+
+        head, count, times, values = node
+        times[head] = t
+        for i, field in enumerate(HISTORY_FIELDS):
+            value = sample.get(field)
+            values[i * self.size + head] = float("nan") if value is None else value
+
+        node[0] = (head + 1) % self.size
+        node[1] = min(count + 1, self.size)
+        self.dirty = True
+
+    def last(self, id: str) -> int:
+        """Time of the newest sample for node, 0 if none"""
+
+        node = self.nodes.get(id)
+        if node is None or node[1] == 0:
+            return 0
+        return node[2][(node[0] - 1) % self.size]
+
+    def update(self, nodes: dict) -> None:
+        """Sample every node heard since its newest sample, so the same reading is not stored every refresh"""
+
+        for id, node in nodes.items():
+            t = node.get("lastHeard")
+            if not t or t <= self.last(id) or len(id) != 9:
+                continue
+            sample = dict(node.get("deviceMetrics") or {})
+            sample["snr"] = node.get("snr")
+            sample["hopsAway"] = node.get("hopsAway")
+            self.add(id, t, sample)
+
+    def series(self, id: str, field: str) -> list[tuple[int, float]]:
+        """(time, value) samples of field for node, oldest first, skipping missing values"""
+
+        from math import isnan
+
+        node = self.nodes.get(id)
+        if node is None:
+            return []
+        head, count, times, values = node
+        base = HISTORY_FIELDS.index(field) * self.size
+        samples = []
+        for i in range(head - count, head):
+            value = values[base + i % self.size]
+            if not isnan(value):
+                samples.append((times[i % self.size], value))
+        return samples
+
+    def save(self) -> None:
+        import struct
+
+        if not self.config.get("state_history"):
+            return
+        with open(f"{self.path()}.tmp", "wb") as f:
+            f.write(struct.pack("<4sII", self.MAGIC, self.size, len(HISTORY_FIELDS)))
+            for id, (head, count, times, values) in self.nodes.items():
+                f.write(struct.pack("<9sII", id.encode("ascii"), head, count))
+                f.write(times.tobytes())
+                f.write(values.tobytes())
+        os.replace(f"{self.path()}.tmp", self.path())
+        self.dirty = False
+
+
+def sparkline(values: list[float]) -> str:
+    """Inline chart of values scaled between their min and max"""
+
+    low = min(values)
+    span = max(values) - low
+    if span == 0:
+        return SPARKS[3] * len(values)
+    return "".join(SPARKS[int((v - low) / span * (len(SPARKS) - 1))] for v in values)
+
+
+def trend(values: list[float]) -> str:
+    """Arrow comparing the mean of the newer half of the samples to the older half"""
+
+    if len(values) < 4:
+        return "→"
+    half = len(values) // 2
+    older = sum(values[:half]) / half
+    newer = sum(values[-half:]) / half
+    span = max(values) - min(values)
+    if span == 0 or abs(newer - older) < span * 0.1:
+        return "→"
+    return "↑" if newer > older else "↓"
+
+
+def print_menu_node_history(id: str, history: History):
+    """Display node History submenu with min, mean, max, trend and sparkline per field"""
+
+    rows = []
+    for field, label in zip(HISTORY_FIELDS, HISTORY_LABELS):
+        values = [value for t, value in history.series(id, field)]
+        if values:
+            rows.append((label, values))
+    if not rows:
+        return
+
+    menu_item("---", 1)
+    menu_item(f"{icon['telescope']} History", 1)
+    for label, values in rows:
+        menu_item(
+            f"{label:<12} {trend(values)} {sparkline(values[-24:])}",
+            1,
+            font=config["font_mono"],
+            href=config["target_url"],
+        )
+        menu_item(
+            f"min {min(values):.2f} mean {sum(values) / len(values):.2f} max {max(values):.2f} ({len(values)} samples)",
+            2,
+            font=config["font_mono"],
+        )
+
+
+class Forecast:
+    """Battery runway per node from a least squares fit of level or voltage over a sliding window.
+
+    The fit keeps running sums so each new sample adds and each expired sample subtracts its terms, no refit of
+    the history. A rise in charge starts a new window so the slope only ever covers one discharge.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.nodes = load_state(config, "state_forecast", {})
+        self.dirty = False
+
+    def reading(self, node: dict) -> tuple[str, float] | None:
+        """Level if the node reports it, voltage otherwise. Level over 100 means external power."""
+
+        metrics = node.get("deviceMetrics") or {}
+        if metrics.get("batteryLevel") is not None:
+            return "level", metrics["batteryLevel"]
+        if metrics.get("voltage"):
+            return "voltage", metrics["voltage"]
+        return None
+
+    def add(self, id: str, t: int, metric: str, value: float) -> None:
+        state = self.nodes.get(id)
+
+        # start over on a new metric, on power, or when the battery is charging
+        if (
+            state is None
+            or state["metric"] != metric
+            or (metric == "level" and value > 100)
+            or value > state["samples"][-1][1] + self.config[f"forecast_charge_{metric}"]
+        ):
+            state = self.nodes[id] = {
+                "metric": metric,
+                "origin": t,
+                "samples": [],
+                "sums": [0, 0.0, 0.0, 0.0, 0.0],
+                "charging": state is not None and state["metric"] == metric and value <= 100,
+            }
+        elif value < state["samples"][-1][1]:
+            state["charging"] = False
+
+        # hours since origin keeps the sums small enough to stay accurate
+        x = (t - state["origin"]) / 3600
+        state["samples"].append([t, value])
+        self.terms(state, x, value, 1)
+
+        while t - state["samples"][0][0] > self.config["forecast_window"]:
+            old_t, old_value = state["samples"].pop(0)
+            self.terms(state, (old_t - state["origin"]) / 3600, old_value, -1)
+
+        self.dirty = True
+
+    def terms(self, state: dict, x: float, y: float, sign: int) -> None:
+        sums = state["sums"]
+        sums[0] += sign
+        sums[1] += sign * x
+        sums[2] += sign * y
+        sums[3] += sign * x * x
+        sums[4] += sign * x * y
+
+    def update(self, nodes: dict) -> None:
+        """Add a sample for each node heard since its last one"""
+
+        for id, node in nodes.items():
+            t = node.get("lastHeard")
+            reading = self.reading(node)
+            if not t or reading is None:
+                continue
+            state = self.nodes.get(id)
+            if state and state["samples"] and t <= state["samples"][-1][0]:
+                continue
+            self.add(id, t, *reading)
+
+    def slope(self, id: str) -> float | None:
+        """Change per hour from the running sums, None until the window is long enough to trust"""
+
+        state = self.nodes.get(id)
+        if state is None:
+            return None
+        n, sx, sy, sxx, sxy = state["sums"]
+        span = state["samples"][-1][0] - state["samples"][0][0]
+        denominator = n * sxx - sx * sx
+        if n < 3 or span < self.config["forecast_min_span"] or denominator <= 0:
+            return None
+        return (n * sxy - sx * sy) / denominator
+
+    def runway(self, id: str) -> float | None:
+        """Seconds until empty at the current rate of discharge, None if not discharging or not enough data"""
+
+        state = self.nodes.get(id)
+        slope = self.slope(id)
+        if state is None or slope is None or slope >= 0 or state["charging"]:
+            return None
+        empty = self.config[f"forecast_empty_{state['metric']}"]
+        return max(0.0, (state["samples"][-1][1] - empty) / -slope * 3600)
+
+    def status(self, id: str) -> str:
+        """Runway text for the Device submenu"""
+
+        state = self.nodes.get(id)
+        if state is None:
+            return "Unknown"
+        if state["metric"] == "level" and state["samples"][-1][1] > 100:
+            return "Powered"
+        if state["charging"]:
+            return "Charging"
+        runway = self.runway(id)
+        if runway is None:
+            return "Not enough data"
+        days, hours, minutes, seconds = seconds_to_dhms(int(runway))
+        unit = "%" if state["metric"] == "level" else "V"
+        return f"{days}d {hours}h ({self.slope(id):+.2f}{unit}/h)"
+
+    def lowest(self, count: int) -> list[tuple[float, str]]:
+        """Nodes with the shortest runway"""
+
+        runways = ((self.runway(id), id) for id in self.nodes)
+        return sorted(x for x in runways if x[0] is not None)[:count]
+
+    def save(self) -> None:
+        save_state(self.config, "state_forecast", self.nodes)
+        self.dirty = False
+
+
+def print_menu_runway(forecast: Forecast, nodes: dict, depth: int = 1):
+    """Display Lowest runway submenu with the nodes whose batteries will run out first"""
+
+    lowest = forecast.lowest(config["forecast_show"])
+    menu_item(f"{icon['battery_low']} Lowest runway", depth)
+    if not lowest:
+        menu_item("No nodes discharging", depth + 1)
+    for runway, id in lowest:
+        days, hours, minutes, seconds = seconds_to_dhms(int(runway))
+        name = get_node_short_name(nodes.get(id, {})) or ""
+        menu_item(f"{days:>2}d {hours:>2}h {id} {name}", depth + 1, font=config["font_mono"])
+
+
+# map colour for each heard tier from heard_tier()
+TIER_COLORS = {
+    "green": "#2ecc40",
+    "yellow": "#ffdc00",
+    "orange": "#ff851b",
+    "red": "#ff4136",
+    "purple": "#b10dc9",
+    "blue": "#0074d9",
+    "black": "#111111",
+}
+
+MAP_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Meshtastic Menubar Map</title>
+<style>html,body{margin:0;height:100%;font:12px Menlo,monospace}canvas{display:block}#info{position:fixed;top:6px;left:6px;background:#fffe;padding:4px}</style>
+</head><body><div id="info">__SUMMARY__</div><canvas id="map"></canvas>
+<script>
+const data = __GEOJSON__;
+const c = document.getElementById("map"), g = c.getContext("2d"), info = document.getElementById("info");
+const pts = data.features.map(f => [f.geometry.coordinates[0], f.geometry.coordinates[1], f.properties]);
+let x0 = Math.min(...pts.map(p => p[0])), x1 = Math.max(...pts.map(p => p[0]));
+let y0 = Math.min(...pts.map(p => p[1])), y1 = Math.max(...pts.map(p => p[1]));
+const k = Math.cos((y0 + y1) / 2 * Math.PI / 180);
+let scale, ox, oy;
+function fit() {
+  c.width = innerWidth; c.height = innerHeight;
+  scale = 0.9 * Math.min(c.width / ((x1 - x0) * k || 1e-3), c.height / ((y1 - y0) || 1e-3));
+  ox = c.width / 2 - (x0 + x1) / 2 * k * scale; oy = c.height / 2 + (y0 + y1) / 2 * scale;
+}
+const sx = p => ox + p[0] * k * scale, sy = p => oy - p[1] * scale;
+function draw() {
+  g.clearRect(0, 0, c.width, c.height);
+  for (const p of pts) {
+    g.fillStyle = p[2].color; g.beginPath(); g.arc(sx(p), sy(p), 5, 0, 7); g.fill();
+    if (scale > 2000) g.fillText(p[2].name, sx(p) + 7, sy(p) + 4);
+  }
+}
+c.onwheel = e => { const f = e.deltaY < 0 ? 1.25 : 0.8; ox = e.clientX - (e.clientX - ox) * f; oy = e.clientY - (e.clientY - oy) * f; scale *= f; draw(); e.preventDefault(); };
+c.onmousemove = e => {
+  if (e.buttons) { ox += e.movementX; oy += e.movementY; draw(); return; }
+  const hit = pts.find(p => Math.hypot(sx(p) - e.clientX, sy(p) - e.clientY) < 6);
+  info.textContent = hit ? `${hit[2].id} ${hit[2].name} ${hit[2].heard}` : "__SUMMARY__";
+};
+onresize = () => { fit(); draw(); };
+fit(); draw();
+</script></body></html>
+"""
+
+
+class MapExport:
+    """GeoJSON and offline HTML map of node positions. Features are cached per node and only rebuilt when they change."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.features = load_state(config, "state_map", {})
+        self.dirty = False
+
+    def update(self, nodes: dict) -> bool:
+        """Rebuild features for nodes whose position, tier or name changed. Returns True if the map files need writing."""
+
+        seen = set()
+
+        for id, node in nodes.items():
+            position = node.get("position") or {}
+            lat = position.get("latitude")
+            lon = position.get("longitude")
+            if lat is None or lon is None:
+                continue
+            seen.add(id)
+
+            name = get_node_short_name(node) or ""
+            key = [lat, lon, heard_tier(node.get("lastHeard")), name, node.get("lastHeard")]
+
+            cached = self.features.get(id)
+            if cached and cached[0] == key:
+                continue
+
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "id": id,
+                    "name": name,
+                    "tier": key[2],
+                    "color": TIER_COLORS[key[2]],
+                    "heard": str(dt.datetime.fromtimestamp(key[4])) if key[4] else "Not Reported",
+                },
+            }
+            self.features[id] = [key, json.dumps(feature, separators=(",", ":"))]
+            self.dirty = True
+
+        for id in set(self.features) - seen:
+            del self.features[id]
+            self.dirty = True
+
+        # an unchanged map still needs writing if either file was deleted
+        return self.dirty or not all(
+            os.path.exists(f"{self.config['log_dir']}/{self.config[name]}") for name in ("map_geojson", "map_html")
+        )
+
+    def write(self) -> None:
+        """Write both files by joining the cached feature strings"""
+
+        geojson = '{"type":"FeatureCollection","features":[' + ",".join(
+            self.features[id][1] for id in sorted(self.features)
+        ) + "]}"
+
+        with open(f"{self.config['log_dir']}/{self.config['map_geojson']}", "w", encoding="utf-8") as f:
+            f.write(geojson)
+
+        # keep names from closing the script tag early
+        html = MAP_HTML.replace("__GEOJSON__", geojson.replace("</", "<\\/")).replace(
+            "__SUMMARY__", f"{len(self.features)} nodes {ts.replace(microsecond=0)}"
+        )
+        with open(f"{self.config['log_dir']}/{self.config['map_html']}", "w", encoding="utf-8") as f:
+            f.write(html)
+
+    def save(self) -> None:
+        save_state(self.config, "state_map", self.features)
+        self.dirty = False
+
+
+def print_menu_map(depth: int = 1):
+    """Display Show mesh map entry"""
+
+    menu_item(
+        f"{icon['globe_america']} Show mesh map",
+        depth,
+        command=["open", f"{config['log_dir']}/{config['map_html']}"],
+        terminal=False,
+    )
+
+
+# fields compared between snapshots, tier comes from heard_tier()
+ALERT_FIELDS = ("tier", "batteryLevel", "voltage", "channelUtilization")
+ALERT_EVENTS = ("new", "vanished")
+
+
+def node_summary(node: dict) -> dict:
+    """The values alert rules look at for one node"""
+
+    metrics = node.get("deviceMetrics") or {}
+    summary = {"tier": heard_tier(node.get("lastHeard"))}
+    for field in ALERT_FIELDS[1:]:
+        if metrics.get(field) is not None:
+            summary[field] = metrics[field]
+    return summary
+
+
+class Alerts:
+    """Compare each snapshot to the previous one and log alerts for config defined rules.
+
+    Rules are indexed by field so a refresh only evaluates the rules for fields that changed on nodes that changed.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        state = load_state(config, "state_alerts", {})
+        self.previous = state.get("previous")
+        # ids in the radio's own NodeDB last time, the merged view keeps every cached node so cannot show one vanish
+        self.present = state.get("present")
+        self.fired = state.get("fired", {})
+        self.log = deque(state.get("log", []), maxlen=config["alert_keep"])
+        self.new = []
+        self.dirty = False
+
+        self.rules = {}
+        for i, rule in enumerate(config["alerts"] or []):
+            self.rules.setdefault(rule.get("event") or rule.get("field"), []).append((str(i), rule))
+
+    def recent(self) -> int:
+        """Alerts in the last alert_window seconds, shown next to the menubar icon"""
+        return sum(1 for alert in self.log if time.time() - alert["t"] < self.config["alert_window"])
+
+    def check(self, rule: dict, before, after) -> bool:
+        """True if the change from before to after crosses rule"""
+
+        if "to" in rule:
+            return after == rule["to"] and before != after and rule.get("from") in (None, before)
+        if after is None:
+            return False
+        if "below" in rule:
+            return after < rule["below"] and (before is None or before >= rule["below"])
+        if "above" in rule:
+            return after > rule["above"] and (before is None or before <= rule["above"])
+        return False
+
+    def fire(self, id: str, key: str, text: str) -> None:
+        """Log an alert unless the same rule fired for this node within alert_debounce"""
+
+        fired = f"{id} {key}"
+        if time.time() - self.fired.get(fired, 0) < self.config["alert_debounce"]:
+            return
+        self.fired[fired] = time.time()
+        alert = {"t": int(time.time()), "node": id, "text": text}
+        self.log.append(alert)
+        self.new.append(alert)
+
+    def update(self, nodes: dict, present: list[str] = None) -> None:
+        """Evaluate rules against nodes that changed since the previous snapshot.
+
+        present is the ids in the radio's NodeDB before the snapshot cache was merged in, vanished is judged on those.
+        """
+
+        current = {id: node_summary(node) for id, node in nodes.items()}
+        present = set(current if present is None else present)
+        self.dirty = True
+
+        # first run only records the baseline, otherwise every node would be new
+        if self.previous is None:
+            self.previous = current
+            self.present = sorted(present)
+            return
+
+        for id in current.keys() - self.previous.keys():
+            for key, rule in self.rules.get("new", []):
+                self.fire(id, key, "New node")
+        for id in set(self.previous if self.present is None else self.present) - present:
+            for key, rule in self.rules.get("vanished", []):
+                self.fire(id, key, "Vanished")
+        self.present = sorted(present)
+
+        for id, after in current.items():
+            before = self.previous.get(id)
+            if before is None or before == after:
+                continue
+            for field in ALERT_FIELDS:
+                if before.get(field) == after.get(field):
+                    continue
+                for key, rule in self.rules.get(field, []):
+                    if self.check(rule, before.get(field), after.get(field)):
+                        self.fire(id, key, f"{field} {before.get(field)} > {after.get(field)}")
+
+        self.previous = current
+
+    def save(self) -> None:
+        # forget debounce times that can no longer suppress anything
+        self.fired = {k: v for k, v in self.fired.items() if time.time() - v < self.config["alert_debounce"]}
+        save_state(
+            self.config,
+            "state_alerts",
+            {"previous": self.previous, "present": self.present, "fired": self.fired, "log": list(self.log)},
+        )
+        self.dirty = False
+
+
+def alerts_clear(config: dict):
+    """Empty the alert log but keep the snapshot we compare against"""
+
+    alerts = Alerts(config)
+    alerts.log.clear()
+    alerts.save()
+
+
+def print_menu_alerts(alerts: Alerts, nodes: dict, depth: int = 1):
+    """Display Alerts submenu, newest first"""
+
+    menu_item(f"{icon['police']} Alerts: {alerts.recent()}", depth)
+    for alert in reversed(alerts.log):
+        name = get_node_short_name(nodes.get(alert["node"], {})) or ""
+        menu_item(
+            f"{dt.datetime.fromtimestamp(alert['t']):%m-%d %H:%M} {alert['node']} {name} {alert['text']}",
+            depth + 1,
+            font=config["font_mono"],
+        )
+    if alerts.log:
+        menu_item("---", depth + 1)
+        menu_item(
+            "Clear",
+            depth + 1,
+            command=[os.path.abspath(__file__), "clear-alerts"],
+            terminal=False,
+            refresh=True,
+        )
+
+
+class SnapshotCache:
+    """Latest device metrics, position and user per node from received packets, merged into later NodeDB snapshots.
+
+    Nodes not heard from for snapshot_max_age seconds are forgotten, so the radio's own NodeDB eviction still shows.
+    """
+
+    # packet key -> NodeDB section
+    SECTIONS = {"telemetry": "deviceMetrics", "position": "position", "user": "user"}
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.nodes = load_state(config, "state_snapshot", {})
+        self.dirty = False
+        self.prune()
+
+    def add(self, record: dict) -> None:
+        """PacketTap handler, keeps the newest section per node and skips answers older than what we have"""
+
+        for key, section in self.SECTIONS.items():
+            data = record.get(key)
+            if key == "telemetry" and data:
+                t = data.get("time") or record["t"]
+                data = data.get("deviceMetrics")
+            elif data:
+                t = data.get("time") or record["t"]
+            if not data or time.time() - t >= self.config["snapshot_max_age"]:
+                continue
+
+            entry = self.nodes.setdefault(record["from"], {"t": {}})
+            if entry["t"].get(section, 0) >= t:
+                continue
+            entry[section] = data
+            entry["t"][section] = t
+            self.dirty = True
+
+    def age(self, id: str, section: str) -> float:
+        """Seconds since we last had section for node"""
+        return time.time() - self.nodes.get(id, {}).get("t", {}).get(section, 0)
+
+    def fresh(self, entry: dict) -> bool:
+        """True if any section of the entry is younger than snapshot_max_age"""
+        return time.time() - max(entry["t"].values(), default=0) < self.config["snapshot_max_age"]
+
+    def prune(self) -> None:
+        """Forget nodes we have not heard from for snapshot_max_age"""
+
+        fresh = {id: entry for id, entry in self.nodes.items() if self.fresh(entry)}
+        if len(fresh) < len(self.nodes):
+            self.nodes = fresh
+            self.dirty = True
+
+    def merge(self, nodes: dict) -> dict:
+        """Fill missing or older sections of nodes from the cache, nodes older than snapshot_max_age are left out"""
+
+        for id, entry in self.nodes.items():
+            if not self.fresh(entry):
+                continue
+            node = nodes.setdefault(id, {"num": int(id[1:], 16)})
+            for section, t in entry["t"].items():
+                if not node.get(section) or t > node.get("lastHeard", 0):
+                    node[section] = entry[section]
+            node["lastHeard"] = max(node.get("lastHeard", 0), *entry["t"].values())
+        return nodes
+
+    def save(self) -> None:
+        self.prune()
+        save_state(self.config, "state_snapshot", self.nodes)
+        self.dirty = False
+
+
+class PollScheduler:
+    """Queue of position and telemetry requests sent within an airtime budget.
+
+    Requests for the same node and kind are coalesced, requests are skipped if the cache already has a fresh
+    answer, and sending backs off while our node reports a busy channel.
+    """
+
+    # poll kind -> section of the snapshot the answer lands in
+    KINDS = {"telemetry": "deviceMetrics", "position": "position"}
+
+    def __init__(self, config: dict, iface, snapshot: SnapshotCache, executor: "CommandExecutor" = None):
+        self.config = config
+        self.iface = iface
+        self.snapshot = snapshot
+        # only needed to send queued polls, a refresh that only spends from the budget goes without
+        self.executor = executor
+        self.pending = {}
+        # airtime spent is shared by every run, a refresh asking for missing data spends from the same budget
+        self.sent = deque(load_state(config, "state_poll", []))
+        self.backoff = 0
+        self.lock = threading.Lock()
+
+    def add(self, kind: str, ids: list[str]) -> int:
+        """Queue requests, dict keys coalesce duplicates and keep first-come order"""
+
+        with self.lock:
+            before = len(self.pending)
+            for id in ids:
+                self.pending.setdefault((dest_id(id), kind), time.time())
+            return len(self.pending) - before
+
+    def airtime(self, id: str) -> float:
+        """Estimated channel airtime for request and reply, every hop repeats both"""
+
+        hops = self.iface.nodes.get(id, {}).get("hopsAway", 3)
+        return self.config["poll_airtime"] * 2 * (hops + 1)
+
+    def budget(self) -> float:
+        """Airtime seconds left in the sliding poll_window"""
+
+        while self.sent and time.time() - self.sent[0][0] > self.config["poll_window"]:
+            self.sent.popleft()
+        return self.config["poll_duty_cycle"] * self.config["poll_window"] - sum(x[1] for x in self.sent)
+
+    def busy(self) -> bool:
+        """True if our node reports more channel or transmit utilization than we are willing to add to"""
+
+        metrics = (self.iface.getMyNodeInfo() or {}).get("deviceMetrics", {})
+        return (
+            metrics.get("channelUtilization", 0) > self.config["poll_max_channel_utilization"]
+            or metrics.get("airUtilTx", 0) > self.config["poll_max_air_utilization"]
+        )
+
+    def allow(self, id: str) -> float:
+        """Spend airtime on one request to id if the channel and budget allow, call with the lock held.
+
+        Returns 0 when the request may go out now, otherwise the seconds to wait before trying again.
+        """
+
+        if self.busy():
+            self.backoff = min(max(self.backoff * 2, 30), self.config["poll_backoff_max"])
+            return self.backoff
+        self.backoff = 0
+
+        airtime = self.airtime(id)
+        if self.budget() < airtime:
+            return self.sent[0][0] + self.config["poll_window"] - time.time() if self.sent else self.config["poll_window"]
+
+        self.sent.append((time.time(), airtime))
+        save_state(self.config, "state_poll", list(self.sent))
+        return 0
+
+    def step(self) -> float | None:
+        """Send the next request if allowed. Returns seconds to wait before the next step, None when the queue is empty."""
+
+        with self.lock:
+            if not self.pending:
+                return None
+            (id, kind), queued = next(iter(self.pending.items()))
+
+            # coalesce with answers that arrived while queued, from us or anyone else asking
+            if self.snapshot.age(id, self.KINDS[kind]) < self.config["poll_fresh"]:
+                del self.pending[(id, kind)]
+                return 0
+
+            wait = self.allow(id)
+            if wait:
+                return wait
+            del self.pending[(id, kind)]
+
+        # the executor asks with its own response callback, so a node that never answers only fails its own poll
+        args = ["telemetry", id, "device"] if kind == "telemetry" else ["position", id]
+        results = self.executor.submit(args)
+        log_commands(self.config, results)
+        for result in results:
+            print(result["result"])
+        return 0
+
+    def run(self, deadline: float = None) -> None:
+        """Work through the queue until empty or deadline, forever if there is no deadline"""
+
+        while deadline is None or time.time() < deadline:
+            wait = self.step()
+            if wait is None:
+                if deadline is not None:
+                    return
+                wait = 60
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+            time.sleep(max(wait, 0))
+
+    def stale(self, kind: str) -> list[str]:
+        """Nodes heard lately whose answer for kind is older than poll_fresh"""
+
+        me = (self.iface.getMyNodeInfo() or {}).get("user", {}).get("id")
+        return [
+            id
+            for id, node in (copy_nodes(self.iface) or {}).items()
+            if id != me
+            and time.time() - node.get("lastHeard", 0) < self.config["poll_heard"]
+            and self.snapshot.age(id, self.KINDS[kind]) > self.config["poll_fresh"]
+        ]
+
+
+class Enricher:
+    """Ask nodes for the user, position or device metrics missing from both the NodeDB and the snapshot cache.
+
+    Requests go out from a bounded pool in priority order, favourites then fewest hops then most recently heard.
+    Each one spends from the poll scheduler's airtime budget and none go out while the channel is busy. Each worker
+    waits for its answer until the shared deadline. Answers land in the snapshot cache through the packet tap, so
+    later runs show them without asking the radio again.
+    """
+
+    # NodeDB section -> portnum of the request that answers it
+    SECTIONS = {"user": "NODEINFO_APP", "position": "POSITION_APP", "deviceMetrics": "TELEMETRY_APP"}
+
+    def __init__(self, config: dict, iface, snapshot: SnapshotCache, scheduler: PollScheduler):
+        self.config = config
+        self.iface = iface
+        self.snapshot = snapshot
+        self.scheduler = scheduler
+        self.asked = load_state(config, "state_enrich", {})
+        # the interface writes one packet at a time
+        self.lock = threading.Lock()
+
+    def wanted(self, nodes: dict, me: str) -> list[tuple[str, str]]:
+        """Missing sections per node, highest priority first, skipping ones asked for within enrich_retry"""
+
+        def priority(id):
+            node = nodes[id]
+            return (not node.get("isFavorite"), node.get("hopsAway", 99), -node.get("lastHeard", 0))
+
+        wanted = []
+        for id in sorted((id for id in nodes if id != me), key=priority):
+            cached = self.snapshot.nodes.get(id, {})
+            for section in self.SECTIONS:
+                if nodes[id].get(section) or cached.get(section):
+                    continue
+                if time.time() - self.asked.get(f"{id} {section}", 0) < self.config["enrich_retry"]:
+                    continue
+                wanted.append((id, section))
+        return wanted
+
+    def request(self, section: str, me: dict):
+        """Empty request payload for section, a node answers NodeInfo with its own user"""
+
+        from meshtastic.protobuf import mesh_pb2, telemetry_pb2
+
+        match section:
+            case "user":
+                return mesh_pb2.User(
+                    id=me.get("id", ""),
+                    long_name=me.get("longName", ""),
+                    short_name=me.get("shortName", ""),
+                )
+            case "position":
+                return mesh_pb2.Position()
+            case "deviceMetrics":
+                return telemetry_pb2.Telemetry(device_metrics=telemetry_pb2.DeviceMetrics())
+
+    def ask(self, id: str, section: str, me: dict, deadline: float) -> bool:
+        """Send one request and wait for its answer. True if the node answered before the deadline."""
+
+        if time.time() >= deadline:
+            return False
+
+        # left for a later refresh when the channel is busy or the budget is spent
+        with self.scheduler.lock:
+            if self.scheduler.allow(id):
+                return False
+
+        self.asked[f"{id} {section}"] = time.time()
+        try:
+            send_request(self.iface, id, self.SECTIONS[section], self.request(section, me), deadline - time.time(), self.lock)
+        except Exception:
+            return False
+        return True
+
+    def run(self, nodes: dict, me: dict) -> int:
+        """Ask for up to enrich_batch missing sections within enrich_deadline seconds. Returns the number answered."""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        wanted = self.wanted(nodes, me.get("id"))[: self.config["enrich_batch"]]
+        if not wanted:
+            return 0
+
+        deadline = time.time() + self.config["enrich_deadline"]
+        with ThreadPoolExecutor(max_workers=self.config["enrich_workers"]) as pool:
+            answered = sum(pool.map(lambda x: self.ask(*x, me, deadline), wanted))
+
+        self.save()
+        return answered
+
+    def save(self) -> None:
+        # forget asks old enough to be asked again
+        self.asked = {k: v for k, v in self.asked.items() if time.time() - v < self.config["enrich_retry"]}
+        save_state(self.config, "state_enrich", self.asked)
+
+
+def collector_start(config: dict) -> tuple[PacketTap, dict]:
+    """Start the packet tap with every store that builds on it. Subscribe before connecting so we catch the initial burst."""
+
+    tap = packet_tap_start(config)
+    stores = {
+        "messages": MessageStore(config),
+        "topology": Topology(config),
+        "snapshot": SnapshotCache(config),
+    }
+    for store in stores.values():
+        tap.subscribe(store.add)
+    return tap, stores
+
+
+def collector_save(stores: dict) -> None:
+    for store in stores.values():
+        if store.dirty:
+            store.save()
+
+
+def encode_value(value) -> bytes:
+    """Compact tagged binary encoding of json-like values.
+
+    Each value is a one byte tag then its data, ints are zigzag varints and floats are doubles. Dict keys are
+    written once and then referred to by number since every node repeats the same few dozen keys.
+    """
+
+    import struct
+
+    double = struct.Struct("<d")
+    out = bytearray()
+    keys = {}
+
+    def varint(n: int):
+        while n > 0x7F:
+            out.append(n & 0x7F | 0x80)
+            n >>= 7
+        out.append(n)
+
+    def text(tag: bytes, data: bytes):
+        out.extend(tag)
+        varint(len(data))
+        out.extend(data)
+
+    def write(v):
+        if v is None:
+            out.extend(b"N")
+        elif v is True:
+            out.extend(b"T")
+        elif v is False:
+            out.extend(b"F")
+        elif isinstance(v, int):
+            out.extend(b"i")
+            varint(v << 1 if v >= 0 else (-v << 1) - 1)
+        elif isinstance(v, float):
+            out.extend(b"d")
+            out.extend(double.pack(v))
+        elif isinstance(v, str):
+            text(b"s", v.encode("utf-8"))
+        elif isinstance(v, (bytes, bytearray)):
+            text(b"b", v)
+        elif isinstance(v, dict):
+            out.extend(b"m")
+            varint(len(v))
+            for key, item in v.items():
+                key = str(key)
+                if key in keys:
+                    out.extend(b"k")
+                    varint(keys[key])
+                else:
+                    keys[key] = len(keys)
+                    text(b"K", key.encode("utf-8"))
+                write(item)
+        elif isinstance(v, (list, tuple)):
+            out.extend(b"l")
+            varint(len(v))
+            for item in v:
+                write(item)
+        else:
+            write(str(v))
+
+    write(value)
+    return bytes(out)
+
+
+def decode_value(buf):
+    """Inverse of encode_value(). Reads straight from any buffer, such as a memoryview of a mapped file."""
+
+    import struct
+
+    double = struct.Struct("<d")
+    pos = 0
+    keys = []
+
+    def varint() -> int:
+        nonlocal pos
+        n = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def data() -> bytes:
+        nonlocal pos
+        size = varint()
+        pos += size
+        return bytes(buf[pos - size : pos])
+
+    def read():
+        nonlocal pos
+        tag = chr(buf[pos])
+        pos += 1
+        match tag:
+            case "N":
+                return None
+            case "T":
+                return True
+            case "F":
+                return False
+            case "i":
+                n = varint()
+                return -((n + 1) >> 1) if n & 1 else n >> 1
+            case "d":
+                pos += 8
+                return double.unpack_from(buf, pos - 8)[0]
+            case "s":
+                return data().decode("utf-8")
+            case "b":
+                return data()
+            case "l":
+                return [read() for _ in range(varint())]
+            case "m":
+                value = {}
+                for _ in range(varint()):
+                    if chr(buf[pos]) == "K":
+                        pos += 1
+                        keys.append(data().decode("utf-8"))
+                        key = keys[-1]
+                    else:
+                        pos += 1
+                        key = keys[varint()]
+                    value[key] = read()
+                return value
+        raise ValueError(f"bad tag {tag!r} at {pos - 1}")
+
+    return read()
+
+
+class SharedSnapshot:
+    """Node table published by the listen collector into a memory mapped file for any number of readers.
+
+    The file is a header of magic, generation, publish time and payload length, then the payload in the
+    encode_value() format. The one writer holds an flock on the lock file and makes the generation odd while it
+    writes and even when it is done. A reader that sees the same even generation before and after decoding has a
+    whole snapshot, without ever taking a lock or touching the radio.
+    """
+
+    MAGIC = b"MMS1"
+    # magic, pad so the generation is 8 byte aligned, generation, time, payload length, pad
+    HEADER = "<4s4xQdI4x"
+
+    def __init__(self, config: dict):
+        import struct
+
+        self.config = config
+        self.path = f"{config['log_dir']}/{config['shm_snapshot']}"
+        self.header = struct.Struct(self.HEADER)
+        self.lock = None
+        self.map = None
+        self.generation = 0
+
+    def writer(self) -> "SharedSnapshot | None":
+        """Become the one writer. Returns None if another collector already publishes."""
+
+        import fcntl
+        import mmap
+
+        self.lock = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock.close()
+            return None
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size < self.header.size:
+            os.ftruncate(fd, 64 * 1024)
+        self.map = mmap.mmap(fd, 0)
+        os.close(fd)
+
+        # carry on from the last generation so a reader mid-read across a restart still sees a change
+        magic, generation, t, length = self.header.unpack_from(self.map)
+        if magic == self.MAGIC:
+            self.generation = generation + generation % 2
+        else:
+            self.header.pack_into(self.map, 0, self.MAGIC, 0, 0, 0)
+        return self
+
+    def publish(self, data) -> None:
+        import mmap
+        import struct
+
+        payload = encode_value(data)
+        size = self.header.size + len(payload)
+        if size > len(self.map):
+            # grow with room to spare, readers map the whole file on every read so they see the new size
+            with open(self.path, "r+b") as f:
+                f.truncate(size * 2)
+                self.map.close()
+                self.map = mmap.mmap(f.fileno(), 0)
+
+        self.generation += 1
+        struct.pack_into("<Q", self.map, 8, self.generation)
+        self.map[self.header.size : size] = payload
+        struct.pack_into("<dI", self.map, 16, time.time(), len(payload))
+        self.generation += 1
+        struct.pack_into("<Q", self.map, 8, self.generation)
+
+    def alive(self) -> bool:
+        """True while a writer holds the lock"""
+
+        import fcntl
+
+        try:
+            with open(f"{self.path}.lock", "r") as f:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def read(self, max_age: float = None):
+        """Latest snapshot, or None if there is no live writer, it is older than max_age or it keeps changing under us"""
+
+        import mmap
+
+        if not self.alive():
+            return None
+
+        for attempt in range(10):
+            try:
+                with open(self.path, "rb") as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+
+            with m:
+                magic, generation, t, length = self.header.unpack_from(m)
+                if magic != self.MAGIC:
+                    return None
+                if generation % 2 == 0 and self.header.size + length <= len(m):
+                    try:
+                        with memoryview(m) as view, view[self.header.size : self.header.size + length] as payload:
+                            data = decode_value(payload)
+                    except (IndexError, ValueError, UnicodeDecodeError):
+                        data = None
+                    if self.header.unpack_from(m)[1] == generation:
+                        if max_age is not None and time.time() - t > max_age:
+                            return None
+                        return data
+            time.sleep(0.001 * 2**attempt)
+        return None
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        if self.lock is not None:
+            self.lock.close()
+
+
+def shared_publish(shared: SharedSnapshot, iface, stores: dict) -> None:
+    """Publish the NodeDB merged with the snapshot cache.
+
+    Call with the tap lock held. Store handlers run under it, so the cache cannot change while it is merged. The
+    NodeDB itself is updated by meshtastic's reader thread before the tap sees the packet, so copying it may need
+    another try.
+    """
+
+    nodes = copy_nodes(iface, recursive_copy)
+    if nodes is None:
+        return
+    # present lets readers tell which nodes the radio still holds, for the vanished alert
+    shared.publish(
+        {
+            "me": (iface.getMyNodeInfo() or {}).get("user") or {},
+            "present": list(nodes),
+            "nodes": stores["snapshot"].merge(nodes),
+        }
+    )
+
+
+def traceroute_targets(config: dict, iface, topology: Topology) -> list[str]:
+    """Most recently heard nodes that have not been traced lately, up to traceroute_batch"""
+
+    me = iface.getMyNodeInfo()["user"]["id"]
+    nodes = copy_nodes(iface) or {}
+    return [
+        id
+        for id in sorted(nodes, reverse=True, key=lambda x: nodes[x].get("lastHeard", 0))
+        if id != me
+        and time.time() - topology.routes.get(id, {}).get("t", 0) > config["traceroute_min_age"]
+    ][: config["traceroute_batch"]]
+
+
+def dest_id(dest: str) -> str:
+    """Normalise a destination from the menu or command line to the !hex id meshtastic expects"""
+
+    if dest == "^all":
+        return dest
+    return "!" + dest.lstrip("\\!").lower()
+
+
+def send_request(
+    iface, dest: str, port: str, payload, timeout: float, lock: threading.Lock = None, hop_limit: int = None
+) -> dict:
+    """Send a request that wants a response and wait for it. Returns the response packet.
+
+    meshtastic's own callbacks for position and telemetry requests call sys.exit from the receive thread when a
+    node does not answer, which would end a listen collector, so requests go out with sendData and this callback.
+    The callback runs in the receive thread before the packet is published, so callers use the packet it returns
+    rather than what the PacketTap stores have made of it.
+    Raises TimeoutError when nothing comes back in time and ValueError when the mesh reports a routing error.
+    """
+
+    from meshtastic.protobuf import portnums_pb2
+
+    answers = []
+    answered = threading.Event()
+
+    def on_response(packet):
+        # also called with a routing error when the node does not answer
+        answers.append(packet)
+        answered.set()
+
+    with lock or threading.Lock():
+        iface.sendData(
+            payload,
+            destinationId=dest,
+            portNum=portnums_pb2.PortNum.Value(port),
+            wantResponse=True,
+            onResponse=on_response,
+            hopLimit=hop_limit,
+        )
+
+    if not answered.wait(max(timeout, 0)):
+        raise TimeoutError(f"no answer from {dest}")
+
+    decoded = answers[0].get("decoded", {})
+    if decoded.get("portnum") == "ROUTING_APP":
+        error = decoded.get("routing", {}).get("errorReason", "NONE")
+        if error != "NONE":
+            raise ValueError(f"{dest} {error}")
+    return answers[0]
+
+
+def log_commands(config: dict, results: list[dict]) -> None:
+    """Append command outcomes to log_commands. Menu commands run without a terminal so this is where they report."""
+
+    if not config.get("log_commands"):
+        return
+    with open(f"{config['log_dir']}/{config['log_commands']}", "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(f"{dt.datetime.now().replace(microsecond=0)} {'ok' if result['ok'] else 'failed'} {result['result']}\n")
+
+
+# meshtastic cli names for telemetry requests
+TELEMETRY_TYPES = {
+    "device": "device_metrics",
+    "environment": "environment_metrics",
+    "air_quality": "air_quality_metrics",
+    "power": "power_metrics",
+    "local_stats": "local_stats",
+}
+
+
+class CommandExecutor:
+    """Run commands one at a time on an open interface. Commands are queued so callers can share one connection."""
+
+    def __init__(self, config: dict, iface, stores: dict, background: bool = False):
+        import queue
+
+        self.config = config
+        self.iface = iface
+        # a listen collector runs long batches in the background and reports them to log_commands
+        self.background = background
+        self.topology = stores["topology"]
+        self.scheduler = PollScheduler(config, iface, stores["snapshot"], self)
+        self.queue = queue.Queue()
+        self.last_traceroute = 0
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job["deadline"] is not None and time.time() > job["deadline"]:
+                    raise TimeoutError("batch ran past its deadline")
+                job["result"] = {"ok": True, "result": self.execute(job["args"])}
+            except Exception as e:
+                job["result"] = {"ok": False, "result": f"{' '.join(job['args'])} failed: {e}"}
+            if job["log"]:
+                log_commands(self.config, [job["result"]])
+            job["done"].set()
+
+    def enqueue(self, args: list[str], deadline: float = None, log: bool = False) -> dict:
+        job = {"args": args, "done": threading.Event(), "result": None, "deadline": deadline, "log": log}
+        self.queue.put(job)
+        return job
+
+    def submit(self, args: list[str]) -> list[dict]:
+        """Queue a command and wait for the results. A traceroute batch is queued per target so other commands can run in between."""
+
+        if args[0] == "traceroute" and not args[1:]:
+            targets = traceroute_targets(self.config, self.iface, self.topology)
+            if self.background:
+                for target in targets:
+                    self.enqueue(["traceroute", target], log=True)
+                return [{"ok": True, "result": f"Queued {len(targets)} traceroutes, results go to the command log"}]
+            # the menu waits for the whole batch, so stop starting new traceroutes after traceroute_deadline
+            deadline = time.time() + self.config["traceroute_deadline"]
+            jobs = [self.enqueue(["traceroute", target], deadline) for target in targets]
+        elif args[0] == "traceroute":
+            jobs = [self.enqueue(["traceroute", dest_id(target)]) for target in args[1:]]
+        elif args[0] == "poll":
+            # polls go to the scheduler rather than straight onto the radio
+            kind = args[1] if len(args) > 1 else "telemetry"
+            if kind not in self.scheduler.KINDS:
+                return [{"ok": False, "result": f"poll {kind} failed: unknown kind"}]
+            count = self.scheduler.add(kind, args[2:] or self.scheduler.stale(kind))
+            return [{"ok": True, "result": f"Queued {count} {kind} polls, {len(self.scheduler.pending)} pending"}]
+        else:
+            jobs = [self.enqueue(args)]
+
+        for job in jobs:
+            job["done"].wait()
+        return [job["result"] for job in jobs]
+
+    def execute(self, args: list[str]) -> str:
+        iface = self.iface
+
+        match args:
+            case ["send", dest, *words]:
+                text = " ".join(words)
+                iface.sendText(text, destinationId=dest_id(dest))
+                return f"Sent to {dest_id(dest)}: {text}"
+
+            case ["position", dest]:
+                from meshtastic.protobuf import mesh_pb2
+
+                answer = send_request(iface, dest_id(dest), "POSITION_APP", mesh_pb2.Position(), self.config["command_timeout"])
+                position = answer["decoded"].get("position", {})
+                return f"Position {dest_id(dest)}: {position.get('latitude')}, {position.get('longitude')}"
+
+            case ["telemetry", dest, telemetry_type]:
+                from meshtastic.protobuf import telemetry_pb2
+
+                if telemetry_type not in TELEMETRY_TYPES:
+                    raise ValueError(f"unknown telemetry type, choose from {', '.join(TELEMETRY_TYPES)}")
+                request = telemetry_pb2.Telemetry()
+                getattr(request, TELEMETRY_TYPES[telemetry_type]).SetInParent()
+                answer = send_request(iface, dest_id(dest), "TELEMETRY_APP", request, self.config["command_timeout"])
+                telemetry = answer["decoded"].get("telemetry", {})
+                metrics = ", ".join(f"{k}: {v}" for section in telemetry.values() if isinstance(section, dict) for k, v in section.items())
+                return f"Telemetry {telemetry_type} from {dest_id(dest)}: {metrics}"
+
+            case ["traceroute", dest]:
+                from meshtastic.protobuf import mesh_pb2
+
+                # wait out the interval here rather than flooding the channel with a batch
+                wait = self.last_traceroute + self.config["traceroute_interval"] - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self.last_traceroute = time.time()
+                answer = send_request(
+                    iface,
+                    dest_id(dest),
+                    "TRACEROUTE_APP",
+                    mesh_pb2.RouteDiscovery(),
+                    self.config["command_timeout"],
+                    hop_limit=iface.localNode.localConfig.lora.hop_limit or 3,
+                )
+                return self.traceroute_log(answer)
+
+            case ["reboot"]:
+                iface.localNode.reboot()
+                return "Rebooting"
+
+            case ["shutdown"]:
+                iface.localNode.shutdown()
+                return "Shutting down"
+
+        raise ValueError("unknown command")
+
+    def traceroute_log(self, answer: dict) -> str:
+        """Append the route in a traceroute reply to log_traceroute_log and return it.
+
+        The route comes from the reply itself, the topology only merges it once the packet has been published.
+        """
+
+        record = compact_packet(answer)
+        towards = parse_traceroute(record)[0]
+        line = f"{dt.datetime.fromtimestamp(record['t'])} {' > '.join([towards[0][0]] + [hop[1] for hop in towards])}"
+        if self.config.get("log_traceroute_log"):
+            with open(
+                f"{self.config['log_dir']}/{self.config['log_traceroute_log']}",
+                "a",
+                encoding="utf-8",
+            ) as f:
+                f.write(line + "\n")
+        return line
+
+
+def command_server_start(config: dict, executor: CommandExecutor):
+    """Accept commands from other processes on a unix socket, one json line in and one json line out"""
+
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                results = executor.submit(json.loads(self.rfile.readline()))
+            except Exception as e:
+                results = [{"ok": False, "result": str(e)}]
+            self.wfile.write(json.dumps(results).encode("utf-8") + b"\n")
+
+    path = f"{config['log_dir']}/{config['command_socket']}"
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def command_client(config: dict, args: list[str]) -> list[dict] | None:
+    """Hand a command to a running listen collector. Returns None if there is no collector to talk to."""
+
+    import socket
+
+    path = f"{config['log_dir']}/{config['command_socket']}"
+    if not config.get("command_socket") or not os.path.exists(path):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+            s.sendall(json.dumps(args).encode("utf-8") + b"\n")
+            return json.loads(s.makefile("rb").readline())
+    except (OSError, ValueError):
+        # stale socket left behind by a collector that died
+        return None
+
+
+def command(config: dict, args: list[str]):
+    """Run a menu action. Uses the listen collector's connection if one is running, otherwise connects just for this."""
+
+    results = command_client(config, args)
+
+    if results is None:
+        tap, stores = collector_start(config)
+        iface = get_iface(config, config.get("connection"))
+        if iface is None:
+            print("No connection method set")
+            exit(1)
+
+        executor = CommandExecutor(config, iface, stores)
+        results = executor.submit(args)
+        if args[0] == "poll":
+            for result in results:
+                print(result["result"])
+            executor.scheduler.run(deadline=time.time() + config["poll_deadline"])
+            results = [{"ok": True, "result": f"{len(executor.scheduler.pending)} polls left for next time"}]
+
+        tap.close()
+        collector_save(stores)
+        iface.close()
+
+    log_commands(config, results)
+    for result in results:
+        print(result["result"])
+
+    if not all(result["ok"] for result in results):
+        exit(1)
+
+
+def listen(config: dict):
+    """Hold the connection open and capture packets until interrupted"""
+
+    tap, stores = collector_start(config)
+    iface = get_iface(config, config.get("connection"))
+    if iface is None:
+        print("No connection method set")
+        exit(1)
+    executor = CommandExecutor(config, iface, stores, background=True)
+    threading.Thread(target=executor.scheduler.run, daemon=True).start()
+    server = None
+    if config.get("command_socket"):
+        server = command_server_start(config, executor)
+
+    # menus and other readers take the node table from here rather than opening their own connection
+    shared = None
+    if config.get("shm_snapshot"):
+        shared = SharedSnapshot(config).writer()
+        if shared is None:
+            print(f"Another collector is publishing {config['log_dir']}/{config['shm_snapshot']}")
+        else:
+            with tap.lock:
+                shared_publish(shared, iface, stores)
+
+    print(f"Listening on {config.get('connection')}, logging to {config['log_dir']}/{config['log_packets']}")
+    try:
+        while True:
+            time.sleep(60)
+            with tap.lock:
+                tap.flush()
+                collector_save(stores)
+                if shared is not None:
+                    shared_publish(shared, iface, stores)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if shared is not None:
+            shared.close()
+        if server:
+            server.shutdown()
+            os.remove(f"{config['log_dir']}/{config['command_socket']}")
+        tap.close()
+        collector_save(stores)
+        iface.close()
+
+
 def cli(config: dict):
     """This is __main__ code when called as cli vs testing."""
 
     #
     # show menu bar icon asap so that if we throw exception we still have a menu
+    # alert count is from the alert log so far until this run's alerts are in
     #
-    print_menu_icon()
+    alerts = Alerts(config)
+    print_menu_icon(menu_status=alerts.recent() or None)
 
     no_device = False
     test_empty = False
 
+    #
+    # tap packets while we are connected, subscribe first so we catch the initial burst
+    #
+    tap, stores = collector_start(config)
+
+    #
+    # take the node table from a running listen collector if there is one, the radio may only allow one connection
+    #
+    shared = None
+    if config.get("shm_snapshot"):
+        shared = SharedSnapshot(config).read(max_age=config["shm_max_age"])
+
     #
     # get meshtastic interface depending on connection type
     #
-    iface = get_iface(config, config.get("connection"))
+    iface = get_iface(config, config.get("connection")) if shared is None else None
 
-    if iface is None:
-        print("No connection method set")
-        print("Choose wifi, ble, or serial")
+    if iface is None and shared is None:
+        menu_item("No connection method set")
+        menu_item("Choose wifi, ble, or serial")
         no_device = "No connection method set"
         print_menu_debug(depth=0)
         print_menu_environment(depth=1)
@@ -973,7 +3695,54 @@ def cli(config: dict):
         # should we exit 0 or 1? how does xbar handle this vs swiftbar?
         exit(0)
 
-    nodes = get_nodes(config, iface)
+    if shared is not None:
+        nodes, me, present = shared["nodes"], shared["me"], shared.get("present")
+    else:
+        # optionally stay connected a little longer to capture live packets
+        if config.get("listen_seconds"):
+            time.sleep(config["listen_seconds"])
+
+        nodes = get_nodes(config, iface)
+        me = (iface.getMyNodeInfo() or {}).get("user") or {}
+
+        # ask incomplete nodes for what they are missing while the tap is still catching answers
+        if config.get("enrich_deadline") and config.get("enrich_batch"):
+            scheduler = PollScheduler(config, iface, stores["snapshot"])
+            Enricher(config, iface, stores["snapshot"], scheduler).run(nodes, me)
+
+        # the radio's own NodeDB, before the cache fills in nodes it has dropped
+        present = list(nodes)
+
+    tap.close()
+    collector_save(stores)
+    stores["snapshot"].merge(nodes)
+
+    geo = GeoIndex(config)
+    geo.update(nodes, me=me.get("id"))
+    if geo.dirty:
+        geo.save()
+
+    alerts.update(nodes, present)
+    alerts.save()
+    set_menu_status(alerts.recent() or None)
+
+    history = History(config)
+    history.update(nodes)
+    if history.dirty:
+        history.save()
+
+    forecast = Forecast(config)
+    forecast.update(nodes)
+    if forecast.dirty:
+        forecast.save()
+
+    # only rewrite the map when a feature changed
+    mesh_map = None
+    if config.get("map_html") and config.get("map_geojson"):
+        mesh_map = MapExport(config)
+        if mesh_map.update(nodes):
+            mesh_map.write()
+            mesh_map.save()
 
     if config.get("debug"):
         print("Environment:\n", json.dumps(dict(os.environ)))
@@ -983,39 +3752,58 @@ def cli(config: dict):
     #
     # main menu display output
     #
+    for problem in config["config_errors"]:
+        menu_item(f"{icon['police']} Config: {problem}")
+
     print_menu_bar(depth=0)
 
     #
-    # menu drop down begin
+    # menu drop down begin, in the order of the menu view
     #
-    print_menu_about(depth=1)
-    print_menu_refresh(depth=1)
-    print_menu_broadcast(depth=1)
-    print_menu_device(depth=1)
-
-    print_menu_debug(depth=1)
-    print_menu_environment(depth=2)
-    print_menu_config(config, depth=2)
-    # print_menu_nodelist(nodelist, depth=2)
-    print_menu_versions(depth=2)
-
-    print_menu_help(depth=1)
+    for view in config["views"]["menu"]:
+        match view:
+            case "about":
+                print_menu_about(depth=1)
+            case "refresh":
+                print_menu_refresh(depth=1)
+            case "broadcast":
+                print_menu_broadcast(depth=1)
+            case "alerts":
+                print_menu_alerts(alerts, nodes, depth=1)
+            case "runway":
+                print_menu_runway(forecast, nodes, depth=1)
+            case "inbox":
+                print_menu_inbox(stores["messages"], nodes, depth=1)
+            case "topology":
+                print_menu_topology(stores["topology"], nodes, depth=1)
+            case "map" if mesh_map is not None:
+                print_menu_map(depth=1)
+            case "device":
+                print_menu_device(depth=1)
+            case "debug":
+                print_menu_debug(depth=1)
+                print_menu_environment(depth=2)
+                print_menu_config(config, depth=2)
+                # print_menu_nodelist(nodelist, depth=2)
+                print_menu_versions(depth=2)
+            case "help":
+                print_menu_help(depth=1)
 
     #
     # back to main menu again
     #
-    print(f"Every: {config['interval']}m Last Run:")
-    print(f"{ts.replace(microsecond=0)}")
-    print("---")
+    menu_item(f"Every: {config['interval']}m Last Run:")
+    menu_item(f"{ts.replace(microsecond=0)}")
+    menu_item("---")
 
     # bail out if no nodes nothing to show
     if test_empty or no_device or len(nodes) < 1:
-        print(f"{icon['police']} No Device or Nodes!")
+        menu_item(f"{icon['police']} No Device or Nodes!")
         # show no_device holds our exception text
-        print(no_device)
+        menu_item(f"{no_device}")
         exit(0)
 
-    print_menu_nodes(nodes)
+    print_menu_nodes(nodes, packet_stats=tap.stats, geo=geo, history=history, forecast=forecast)
     #
     # End nodes submenu
     #
@@ -1029,16 +3817,44 @@ def cli(config: dict):
     if config.get("log_nodes_jsonl"):
         log_nodes_jsonl(config, nodes)
 
-    iface.close
+    if iface is not None:
+        iface.close()
     # currently 13 seconds with uv on m2, not bad when running every 5m, mostly waiting on radio
-    print(f"Runtime: {dt.datetime.now() - ts}")
+    menu_item(f"Runtime: {dt.datetime.now() - ts}")
 
 
 # TODO globals to move into Class
 telemetry_types = load_telemetry()
 icon = load_icons()
+hops_icons = tuple(icon[name] for name in HOPS_ICONS)
 txts = load_txts()
+menu = []
 
 if __name__ == "__main__":
     config = load_config()
-    cli(config)
+    packs = load_packs(config)
+    icon, telemetry_types, txts = packs["icon"], packs["telemetry"], packs["txts"]
+    hops_icons = tuple(packs["hops"])
+    # commands answer in the terminal, only the menu goes to the bar
+    output = "text"
+    try:
+        match sys.argv[1:]:
+            case ["listen"]:
+                listen(config)
+            case ["clear-alerts"]:
+                alerts_clear(config)
+            case ["snapshot"]:
+                print(json.dumps(SharedSnapshot(config).read(max_age=config["shm_max_age"])))
+            case ["send" | "position" | "telemetry" | "traceroute" | "poll" | "reboot" | "shutdown", *_]:
+                command(config, sys.argv[1:])
+            case ["bench-render", *count]:
+                bench_render(config, *map(int, count))
+            case ["menu", output]:
+                config["bitbar"] = output
+                cli(config)
+            case _:
+                output = config["bitbar"]
+                cli(config)
+    finally:
+        # render even when we bail out early so the error shows in the menu
+        render_menu(output)
@@ -0,0 +1,152 @@
+"""Time and peak memory of each stage of a refresh at 10 to 10k nodes.
+
+Slow, so only run with MESHTASTIC_MENUBAR_BENCH=1. Results are written to tests/benchmarks/latest.json with the git
+revision measured, then compared with the committed tests/benchmarks/baseline.json, and a stage that got much
+slower fails the run. MESHTASTIC_MENUBAR_BENCH=baseline records a new baseline instead.
+"""
+
+import gc
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from conftest import make_nodes
+
+pytestmark = pytest.mark.skipif(not os.environ.get("MESHTASTIC_MENUBAR_BENCH"), reason="set MESHTASTIC_MENUBAR_BENCH=1")
+
+RESULTS = Path(__file__).resolve().parent / "benchmarks"
+BASELINE = RESULTS / "baseline.json"
+
+COUNTS = (10, 100, 1000, 10000)
+
+# slower than this against the baseline fails, smaller counts run too quickly to time reliably
+MAX_SLOWDOWN = 1.5
+MIN_COUNT = 1000
+
+
+def stage_recursive_copy(mm, nodes):
+    mm.recursive_copy(nodes)
+
+
+def stage_calculate_heards(mm, nodes):
+    for node in nodes.values():
+        mm.calculate_heards(heard_last=node.get("lastHeard"))
+
+
+def stage_print_menu_nodes(mm, nodes):
+    mm.print_menu_nodes(nodes)
+    mm.menu.clear()
+
+
+def stage_render_xbar(mm, nodes):
+    mm.print_menu_nodes(nodes)
+    mm.MenuRenderer().render(mm.menu)
+    mm.menu.clear()
+
+
+def stage_geo_index(mm, nodes):
+    # make_nodes repeats the fixture positions, spread them over a city so the index is not one crowded cell
+    for i, node in enumerate(nodes.values()):
+        node["position"] = {"latitude": 37.75 + (i % 97) * 0.0005, "longitude": -122.45 + (i // 97 % 97) * 0.0005}
+    mm.GeoIndex(mm.config).update(nodes)
+
+
+def stage_snapshot_round_trip(mm, nodes):
+    mm.decode_value(mm.encode_value(nodes))
+
+
+def stage_log_nodes_csv(mm, nodes):
+    mm.log_nodes_csv(mm.config, nodes)
+
+
+def stage_log_nodes_jsonl(mm, nodes):
+    mm.log_nodes_jsonl(mm.config, nodes)
+
+
+STAGES = [value for name, value in dict(globals()).items() if name.startswith("stage_")]
+
+
+def measure(stage, mm, nodes) -> dict:
+    """Best wall time of a few runs, then one more under tracemalloc for the peak"""
+
+    runs = max(3, min(5, 2000 // len(nodes)))
+    best = None
+    # like timeit, collecting what earlier stages left behind is not this stage's cost and only adds noise
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            stage(mm, nodes)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    stage(mm, nodes)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"seconds": round(best, 6), "peak_bytes": peak, "runs": runs}
+
+
+def revision() -> str:
+    """Short git revision of the tree measured, with a + when it has uncommitted changes"""
+
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=RESULTS.parent, capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return git("rev-parse", "--short", "HEAD") + ("+" if git("status", "--porcelain", "--untracked-files=no") else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@pytest.fixture(scope="module")
+def results():
+    """Every measurement of this run, stage -> node count -> result"""
+    return {}
+
+
+@pytest.mark.parametrize("count", COUNTS)
+@pytest.mark.parametrize("stage", STAGES, ids=lambda x: x.__name__[len("stage_") :])
+def test_stage(mm, results, stage, count):
+    nodes = make_nodes(count)
+    result = measure(stage, mm, nodes)
+    results.setdefault(stage.__name__[len("stage_") :], {})[str(count)] = result
+    assert result["seconds"] > 0
+
+
+def test_no_stage_slower_than_baseline(plugin, results):
+    """Runs after the stages, saves them and compares them with the baseline"""
+
+    if not results:
+        pytest.skip("no stages ran")
+
+    record = os.environ.get("MESHTASTIC_MENUBAR_BENCH") == "baseline"
+    RESULTS.mkdir(exist_ok=True)
+    with open(BASELINE if record else RESULTS / "latest.json", "w", encoding="utf-8") as f:
+        json.dump({"revision": revision(), "python": plugin.python_version.split()[0], "results": results}, f, indent=1)
+    if record:
+        return
+
+    with open(BASELINE, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nchange from baseline at {baseline['revision']}")
+    slower = []
+    for stage, counts in results.items():
+        for count, new in counts.items():
+            old = baseline["results"].get(stage, {}).get(count)
+            if old is None:
+                continue
+            ratio = new["seconds"] / max(old["seconds"], 1e-9)
+            print(f"  {stage:<22} {count:>6} nodes {ratio:6.2f}x time")
+            if ratio > MAX_SLOWDOWN and int(count) >= MIN_COUNT:
+                slower.append(f"{stage} at {count} nodes {ratio:.2f}x")
+    assert not slower, f"slower than the baseline at {baseline['revision']}: {', '.join(slower)}"
@@ -0,0 +1,392 @@
+"""The packet tap and the stores that build on it, fed with packets shaped like meshtastic's receive callbacks"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+from conftest import FROZEN
+
+
+def packet(id=1, sender="!0badf00d", port="TEXT_MESSAGE_APP", t=None, **decoded):
+    return {
+        "id": id,
+        "fromId": sender,
+        "toId": "^all",
+        "rxTime": t or int(FROZEN.timestamp()),
+        "decoded": {"portnum": port, **decoded},
+    }
+
+
+def test_tap_counts_and_drops_duplicates(mm):
+    tap = mm.PacketTap(mm.config)
+    records = []
+    tap.subscribe(records.append)
+
+    tap.on_receive(packet(1, text="hi"))
+    tap.on_receive({**packet(1, text="hi"), "relayNode": 0x5E})
+    tap.on_receive(packet(2, port="POSITION_APP"))
+
+    stats = tap.stats["!0badf00d"]
+    assert (stats["count"], stats["dupes"]) == (2, 1)
+    assert stats["ports"] == {"TEXT_MESSAGE_APP": 1, "POSITION_APP": 1}
+    assert stats["relays"] == {"94": 1}
+    assert [record["id"] for record in records] == [1, 2]
+    assert len(tap.packets) == 2
+
+
+def test_tap_forgets_ids_beyond_the_buffer(mm):
+    mm.config["packet_buffer"] = 2
+    tap = mm.PacketTap(mm.config)
+    for id in (1, 2, 3, 1):
+        tap.on_receive(packet(id))
+    assert tap.stats["!0badf00d"]["dupes"] == 0
+
+
+def test_handlers_run_under_the_tap_lock(mm):
+    tap, stores = mm.collector_start(mm.config)
+    held = []
+    tap.subscribe(lambda record: held.append(tap.lock.locked()))
+
+    # a save holding the lock must not see the stores change underneath it
+    with tap.lock:
+        thread = threading.Thread(target=tap.on_receive, args=(packet(7, text="later"),))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        assert not stores["messages"].dirty
+        mm.collector_save(stores)
+    thread.join()
+
+    assert held == [True]
+    assert stores["messages"].dirty
+    tap.close()
+
+
+class FakeRadio:
+    """Interface that answers sendData from another thread like the receive thread does"""
+
+    def __init__(self, nodes=None, answer=None):
+        self.nodes = nodes or {}
+        self.answer = answer
+        self.sent = []
+        self.localNode = SimpleNamespace(localConfig=SimpleNamespace(lora=SimpleNamespace(hop_limit=3)))
+
+    def getMyNodeInfo(self):
+        return {"user": {"id": "!a1b2c3d4"}, "deviceMetrics": {}}
+
+    def sendData(self, payload, destinationId, portNum, wantResponse, onResponse, hopLimit=None):
+        self.sent.append((destinationId, portNum))
+        if self.answer is not None:
+            threading.Thread(target=onResponse, args=(self.answer(destinationId, portNum),)).start()
+
+
+def no_response(dest, port):
+    return {"from": dest, "decoded": {"portnum": "ROUTING_APP", "routing": {"errorReason": "NO_RESPONSE"}}}
+
+
+def test_unanswered_request_fails_the_command_only(mm):
+    tap, stores = mm.collector_start(mm.config)
+    executor = mm.CommandExecutor(mm.config, FakeRadio(answer=no_response), stores)
+
+    [result] = executor.submit(["position", "0badf00d"])
+    assert not result["ok"]
+    assert "NO_RESPONSE" in result["result"]
+
+    # the worker survives to run the next command
+    executor.iface.answer = lambda dest, port: {"decoded": {"portnum": "POSITION_APP", "position": {"latitude": 1.5, "longitude": 2.5}}}
+    assert executor.submit(["position", "0badf00d"]) == [{"ok": True, "result": "Position !0badf00d: 1.5, 2.5"}]
+    tap.close()
+
+
+def test_silent_node_times_out(mm):
+    mm.config["command_timeout"] = 0.1
+    tap, stores = mm.collector_start(mm.config)
+    executor = mm.CommandExecutor(mm.config, FakeRadio(), stores)
+    [result] = executor.submit(["telemetry", "0badf00d", "device"])
+    assert not result["ok"] and "no answer" in result["result"]
+    tap.close()
+
+
+def test_command_outcomes_are_logged(mm):
+    mm.log_commands(mm.config, [{"ok": True, "result": "Sent to ^all: hi"}, {"ok": False, "result": "reboot failed"}])
+    with open(f"{mm.config['log_dir']}/{mm.config['log_commands']}", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0].endswith(" ok Sent to ^all: hi")
+    assert lines[1].endswith(" failed reboot failed")
+
+
+def test_unanswered_poll_keeps_the_scheduler_running(mm, capsys):
+    tap, stores = mm.collector_start(mm.config)
+    radio = FakeRadio(nodes={"!0badf00d": {"hopsAway": 1}, "!5e5e5e5e": {"hopsAway": 2}}, answer=no_response)
+    executor = mm.CommandExecutor(mm.config, radio, stores)
+    scheduler = executor.scheduler
+
+    assert scheduler.add("telemetry", ["0badf00d", "5e5e5e5e", "!0badf00d"]) == 2
+    scheduler.run(deadline=mm.time.time() + 5)
+
+    assert [dest for dest, port in radio.sent] == ["!0badf00d", "!5e5e5e5e"]
+    assert not scheduler.pending
+    assert capsys.readouterr().out.count("NO_RESPONSE") == 2
+    tap.close()
+
+
+def test_poll_budget_and_busy_channel_hold_requests(mm):
+    tap, stores = mm.collector_start(mm.config)
+    radio = FakeRadio(nodes={"!0badf00d": {"hopsAway": 3}})
+    scheduler = mm.PollScheduler(mm.config, radio, stores["snapshot"])
+
+    # four hops of request and reply is more than a budget of 2 seconds
+    mm.config["poll_duty_cycle"] = 2 / mm.config["poll_window"]
+    scheduler.add("position", ["0badf00d"])
+    assert scheduler.step() == mm.config["poll_window"]
+    assert not radio.sent
+
+    mm.config["poll_duty_cycle"] = 0.02
+    radio.getMyNodeInfo = lambda: {"deviceMetrics": {"channelUtilization": 50}}
+    assert scheduler.step() == 30
+    assert scheduler.step() == 60
+    assert not radio.sent
+
+    # a fresh answer heard meanwhile makes the request unnecessary
+    stores["snapshot"].add({"from": "!0badf00d", "t": int(mm.time.time()), "position": {"latitude": 1}})
+    assert scheduler.step() == 0
+    assert not scheduler.pending and not radio.sent
+    tap.close()
+
+
+class Growing(dict):
+    """A NodeDB the reader thread adds a node to while we iterate it, once"""
+
+    grown = False
+
+    def __iter__(self):
+        if not self.grown:
+            self.grown = True
+            raise RuntimeError("dictionary changed size during iteration")
+        return super().__iter__()
+
+    def keys(self):
+        return iter(self)
+
+
+def test_handler_threads_copy_the_nodedb_before_iterating(mm):
+    tap, stores = mm.collector_start(mm.config)
+    now = int(time.time())
+    radio = FakeRadio(nodes=Growing({"!a1b2c3d4": {}, "!0badf00d": {"lastHeard": now}, "!5e5e5e5e": {"lastHeard": now - 1}}))
+    assert mm.PollScheduler(mm.config, radio, stores["snapshot"]).stale("position") == ["!0badf00d", "!5e5e5e5e"]
+    radio.nodes.grown = False
+    assert mm.traceroute_targets(mm.config, radio, stores["topology"]) == ["!0badf00d", "!5e5e5e5e"]
+    tap.close()
+
+
+def test_topology_forgets_old_links_and_routes(mm):
+    now = int(time.time())
+    old = now - mm.config["topology_max_age"] - 1
+    topology = mm.Topology(mm.config)
+    topology.merge(old, [[("!a1b2c3d4", "!5e5e5e5e", 6.0), ("!5e5e5e5e", "!deadbeef", 2.0)]])
+    topology.merge(now, [[("!a1b2c3d4", "!5e5e5e5e", 8.0), ("!5e5e5e5e", "!0badf00d", None)]])
+    assert topology.relays() == {"!5e5e5e5e": ["!deadbeef", "!0badf00d"]}
+
+    topology.save()
+    assert topology.relays() == {"!5e5e5e5e": ["!0badf00d"]}
+    assert "!deadbeef" not in topology.edges["!5e5e5e5e"]
+    assert mm.Topology(mm.config).routes.keys() == {"!0badf00d"}
+
+
+def traceroute_reply(dest, port):
+    return {
+        "fromId": dest,
+        "toId": "!a1b2c3d4",
+        "rxTime": int(FROZEN.timestamp()),
+        "decoded": {"portnum": "TRACEROUTE_APP", "requestId": 7, "traceroute": {"route": [0x5E5E5E5E], "raw": object()}},
+    }
+
+
+def traceroute_radio(mm):
+    now = int(time.time())
+    return FakeRadio(nodes={f"!0000000{i}": {"lastHeard": now - i} for i in range(1, 4)}, answer=traceroute_reply)
+
+
+def test_traceroute_result_comes_from_the_reply(mm):
+    mm.config["traceroute_interval"] = 0
+    tap, stores = mm.collector_start(mm.config)
+    executor = mm.CommandExecutor(mm.config, traceroute_radio(mm), stores)
+
+    # the reply goes to our callback only, the tap has not merged it into the topology yet
+    [result] = executor.submit(["traceroute", "00000001"])
+    assert result == {"ok": True, "result": "2025-09-17 12:00:00 !a1b2c3d4 > !5e5e5e5e > !00000001"}
+    assert stores["topology"].routes == {}
+    with open(f"{mm.config['log_dir']}/{mm.config['log_traceroute_log']}", encoding="utf-8") as f:
+        assert f.read() == result["result"] + "\n"
+
+    mm.config["command_timeout"] = 0.1
+    executor.iface.answer = None
+    [result] = executor.submit(["traceroute", "00000001"])
+    assert result == {"ok": False, "result": "traceroute !00000001 failed: no answer from !00000001"}
+    tap.close()
+
+
+def test_collector_runs_traceroute_batch_in_background(mm):
+    mm.config["traceroute_interval"] = 0
+    tap, stores = mm.collector_start(mm.config)
+    radio = traceroute_radio(mm)
+    executor = mm.CommandExecutor(mm.config, radio, stores, background=True)
+
+    [result] = executor.submit(["traceroute"])
+    assert result == {"ok": True, "result": "Queued 3 traceroutes, results go to the command log"}
+
+    log = f"{mm.config['log_dir']}/{mm.config['log_commands']}"
+    for _ in range(100):
+        if mm.os.path.exists(log) and len(open(log, encoding="utf-8").readlines()) == 3:
+            break
+        time.sleep(0.02)
+    with open(log, encoding="utf-8") as f:
+        assert [line.split(" ", 3)[3] for line in f.read().splitlines()] == [
+            f"2025-09-17 12:00:00 !a1b2c3d4 > !5e5e5e5e > !0000000{i}" for i in (1, 2, 3)
+        ]
+    tap.close()
+
+
+def test_traceroute_batch_stops_at_its_deadline(mm):
+    mm.config["traceroute_deadline"] = -1
+    tap, stores = mm.collector_start(mm.config)
+    radio = traceroute_radio(mm)
+    results = mm.CommandExecutor(mm.config, radio, stores).submit(["traceroute"])
+    assert [result["ok"] for result in results] == [False] * 3
+    assert not radio.sent
+    tap.close()
+
+
+def enrich_nodes():
+    complete = {"user": {"id": "!00000004"}, "position": {"latitude": 1}, "deviceMetrics": {"voltage": 4.1}}
+    return {
+        "!a1b2c3d4": {"hopsAway": 0},
+        "!00000001": {"hopsAway": 1, "lastHeard": 100},
+        "!00000002": {"hopsAway": 0, "lastHeard": 50},
+        "!00000003": {"hopsAway": 3, "lastHeard": 200, "isFavorite": True},
+        "!00000004": {"hopsAway": 0, "lastHeard": 60, **complete},
+        "!00000005": {"hopsAway": 0, "lastHeard": 70},
+    }
+
+
+def test_enricher_asks_favourites_then_nearest_then_latest(mm):
+    tap, stores = mm.collector_start(mm.config)
+    nodes = enrich_nodes()
+    scheduler = mm.PollScheduler(mm.config, FakeRadio(nodes), stores["snapshot"])
+    enricher = mm.Enricher(mm.config, FakeRadio(nodes), stores["snapshot"], scheduler)
+
+    stores["snapshot"].add({"from": "!00000005", "t": int(time.time()), "position": {"latitude": 1}})
+    wanted = enricher.wanted(nodes, "!a1b2c3d4")
+    assert [id for id, section in wanted] == ["!00000003"] * 3 + ["!00000005"] * 2 + ["!00000002"] * 3 + ["!00000001"] * 3
+    assert ("!00000005", "position") not in wanted
+
+    # asked within enrich_retry are left alone
+    enricher.asked["!00000003 user"] = time.time()
+    assert enricher.wanted(nodes, "!a1b2c3d4")[0] == ("!00000003", "position")
+    tap.close()
+
+
+def test_enricher_spends_from_the_poll_budget(mm):
+    mm.config.update(enrich_batch=3, enrich_deadline=5, poll_duty_cycle=5 / mm.config["poll_window"])
+    tap, stores = mm.collector_start(mm.config)
+    nodes = enrich_nodes()
+    radio = FakeRadio(nodes, answer=lambda dest, port: {"decoded": {"portnum": port}})
+    scheduler = mm.PollScheduler(mm.config, radio, stores["snapshot"])
+
+    # four hops of request and reply fit once in a budget of 5 seconds
+    assert mm.Enricher(mm.config, radio, stores["snapshot"], scheduler).run(nodes, {"id": "!a1b2c3d4"}) == 1
+    assert len(radio.sent) == 1
+
+    # the budget spent carries over to the next refresh
+    assert mm.PollScheduler(mm.config, radio, stores["snapshot"]).budget() == 1
+
+    radio.getMyNodeInfo = lambda: {"deviceMetrics": {"airUtilTx": 20}}
+    mm.config["poll_duty_cycle"] = 0.02
+    assert mm.Enricher(mm.config, radio, stores["snapshot"], scheduler).run(nodes, {"id": "!a1b2c3d4"}) == 0
+    assert len(radio.sent) == 1
+    tap.close()
+
+
+def test_message_store_dedups_and_persists(mm):
+    mm.config["inbox_keep"] = 2
+    store = mm.MessageStore(mm.config)
+    t = int(FROZEN.timestamp())
+    for i, (sender, to, text) in enumerate([("!0badf00d", "^all", "one"), ("!0badf00d", "^all", "two"), ("!5e5e5e5e", "!a1b2c3d4", "psst"), ("!0badf00d", "^all", "three")]):
+        store.add({"id": i, "t": t + i, "from": sender, "to": to, "ch": 0, "port": "TEXT_MESSAGE_APP", "text": text})
+    store.add({"id": 1, "t": t + 9, "from": "!0badf00d", "to": "^all", "ch": 0, "port": "TEXT_MESSAGE_APP", "text": "two"})
+    store.add({"id": 9, "t": t + 9, "from": "!0badf00d", "to": "^all", "ch": 0, "port": "POSITION_APP"})
+
+    assert [message["text"] for message in store.channels["0"]] == ["two", "three"]
+    assert [message["text"] for message in store.channels["DM"]] == ["psst"]
+    assert [message["text"] for message in store.nodes["!0badf00d"]] == ["two", "three"]
+    store.save()
+
+    again = mm.MessageStore(mm.config)
+    assert {channel: [m["text"] for m in window] for channel, window in again.channels.items()} == {"0": ["two", "three"], "DM": ["psst"]}
+    assert 1 in again.id_set and 0 not in again.id_set
+
+
+def test_snapshot_cache_forgets_nodes_past_max_age(mm, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(mm.time, "time", lambda: now[0])
+    cache = mm.SnapshotCache(mm.config)
+    cache.add({"from": "!0badf00d", "t": 1_000_000, "position": {"latitude": 1.0}})
+    cache.add({"from": "!5e5e5e5e", "t": 1_000_000 - mm.config["snapshot_max_age"], "position": {"latitude": 2.0}})
+    assert list(cache.nodes) == ["!0badf00d"]
+
+    # past the max age it is no longer filled back in, and the saved state drops it
+    now[0] += mm.config["snapshot_max_age"]
+    assert cache.merge({"!a1b2c3d4": {}}) == {"!a1b2c3d4": {}}
+    cache.save()
+    assert mm.SnapshotCache(mm.config).nodes == {}
+
+
+def traceroute_record(**traceroute):
+    return {"t": 100, "from": "!deadbeef", "to": "!a1b2c3d4", "port": "TRACEROUTE_APP", "hops": 2, "req": 7, "traceroute": traceroute}
+
+
+def test_parse_traceroute_both_legs(mm):
+    legs = mm.parse_traceroute(traceroute_record(route=[0x5E5E5E5E], snrTowards=[24, -128], routeBack=[0x0BADF00D], snrBack=[8, 12]))
+    assert legs == [
+        [("!a1b2c3d4", "!5e5e5e5e", 6.0), ("!5e5e5e5e", "!deadbeef", None)],
+        [("!deadbeef", "!0badf00d", 2.0), ("!0badf00d", "!a1b2c3d4", 3.0)],
+    ]
+    # an snr list of the wrong length is dropped, a back route without one is ignored
+    legs = mm.parse_traceroute(traceroute_record(route=[0x5E5E5E5E], snrTowards=[24], routeBack=[0x0BADF00D]))
+    assert legs == [[("!a1b2c3d4", "!5e5e5e5e", None), ("!5e5e5e5e", "!deadbeef", None)]]
+
+
+def test_topology_smooths_snr_and_finds_paths(mm):
+    topology = mm.Topology(mm.config)
+    t = int(time.time())
+    topology.add({**traceroute_record(route=[0x5E5E5E5E], snrTowards=[24, 8]), "t": t})
+    topology.add({**traceroute_record(route=[0x5E5E5E5E], snrTowards=[40, 8]), "t": t})
+    assert topology.edges["!a1b2c3d4"]["!5e5e5e5e"] == {"snr": 8.0, "seen": t, "count": 2}
+    assert topology.relays() == {"!5e5e5e5e": ["!deadbeef"]}
+
+    # a direct link that is weak still beats two hops
+    topology.merge(t, [[("!a1b2c3d4", "!deadbeef", -15.0)]])
+    assert topology.shortest_path("!a1b2c3d4", "!deadbeef") == ["!a1b2c3d4", "!deadbeef"]
+    assert topology.shortest_path("!deadbeef", "!a1b2c3d4") is None
+    # the latest route to a target replaces the one before
+    assert topology.relays() == {}
+
+
+def test_topology_ignores_traceroute_requests(mm):
+    topology = mm.Topology(mm.config)
+    t = int(time.time())
+    # a request from !11111111 to us that already passed two relays, it has no requestId
+    request = {
+        "t": t,
+        "from": "!11111111",
+        "to": "!a1b2c3d4",
+        "port": "TRACEROUTE_APP",
+        "hops": 2,
+        "traceroute": {"route": [0x22222222, 0x33333333], "snrTowards": [24, 20]},
+    }
+    topology.add(request)
+    # and the same request overheard on its way to someone else
+    topology.add({**request, "to": "!5e5e5e5e"})
+    assert topology.edges == {}
+    assert topology.routes == {}
+    assert not topology.dirty
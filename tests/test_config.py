@@ -0,0 +1,137 @@
+"""Config validation, sections, the mtime cache and packs"""
+
+import os
+
+
+def write_config(mm, text: str):
+    with open(mm.config["config_file"], "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_defaults_are_valid(mm):
+    assert mm.config["config_errors"] == []
+    assert mm.config["target_url"] == "http://meshtastic.local"
+    assert mm.config["views"]["node"] == list(mm.VIEWS["node"])
+
+
+def test_bad_values_fall_back_and_are_reported(mm):
+    write_config(mm, "bitbar: foo\ninterval: '5'\ntypo_key: 1\nlog_nodes_csv: false\nviews:\n  node: [comms, bogus]\n")
+    config = mm.load_config()
+    assert config["bitbar"] == "xbar"
+    assert config["interval"] == 5
+    assert config["log_nodes_csv"] is False
+    assert config["views"]["node"] == ["comms"]
+    assert config["views"]["menu"] == list(mm.VIEWS["menu"])
+    assert len(config["config_errors"]) == 4
+    assert any("typo_key" in problem for problem in config["config_errors"])
+
+
+def test_numbers_keep_their_type(mm):
+    write_config(mm, "history_size: 48.5\nforecast_empty_voltage: 3\npoll_airtime: true\nuse_wifi: true\n")
+    config = mm.load_config()
+    assert config["history_size"] == 48
+    assert config["forecast_empty_voltage"] == 3
+    assert config["poll_airtime"] == 0.5
+    assert config["use_wifi"] is True
+    assert sorted(config["config_errors"]) == ["history_size must be int, not float", "poll_airtime must be float, not bool"]
+
+
+def test_bad_alert_rules_are_dropped(mm):
+    write_config(
+        mm,
+        "alerts:\n"
+        "  - field: batteryLevel\n    below: '20'\n"
+        "  - just a string\n"
+        "  - field: snr\n    below: 0\n"
+        "  - event: gone\n"
+        "  - field: voltage\n"
+        "  - field: voltage\n    below: 3.4\n"
+        "  - event: new\n",
+    )
+    config = mm.load_config()
+    assert config["alerts"] == [{"field": "voltage", "below": 3.4}, {"event": "new"}]
+    assert config["config_errors"] == [
+        "alerts.0 below must be a number, not str",
+        "alerts.1 must be a mapping, not str",
+        "alerts.2 field must be one of tier, batteryLevel, voltage, channelUtilization",
+        "alerts.3 event must be one of new, vanished",
+        "alerts.4 needs to, below or above",
+    ]
+
+    # what is left runs without raising
+    alerts = mm.Alerts(config)
+    alerts.update({"!0badf00d": {"deviceMetrics": {"voltage": 3.6}}})
+    alerts.update({"!0badf00d": {"deviceMetrics": {"voltage": 3.3}}, "!5e5e5e5e": {}})
+    assert [alert["text"] for alert in alerts.new] == ["New node", "voltage 3.6 > 3.3"]
+
+
+def test_radio_and_logging_sections(mm):
+    write_config(
+        mm,
+        "radio: car\n"
+        "radios:\n"
+        "  - name: shack\n"
+        "    wifi_host: shack.local\n"
+        "  - name: car\n"
+        "    connection: ble\n"
+        "    ble_name: CAR\n"
+        "logging:\n"
+        "  dir: /tmp\n"
+        "  packets: null\n",
+    )
+    config = mm.load_config()
+    assert config["config_errors"] == []
+    assert (config["connection"], config["meshtastic_p1"], config["meshtastic_p2"]) == ("ble", "--ble", "CAR")
+    assert config["log_dir"] == "/tmp"
+    assert config["log_packets"] is None
+
+
+def test_unknown_radio_is_reported(mm):
+    write_config(mm, "radio: boat\nradios:\n  - name: shack\n")
+    assert mm.load_config()["config_errors"] == ["radio boat not found in radios"]
+
+
+def test_cache_skips_yaml_until_the_file_changes(mm, monkeypatch):
+    write_config(mm, "interval: 10\n")
+    assert mm.load_config()["interval"] == 10
+
+    def no_yaml(*args, **kwargs):
+        raise AssertionError("yaml parsed for an unchanged config")
+
+    with monkeypatch.context() as m:
+        m.setattr(mm, "load", no_yaml)
+        assert mm.load_config()["interval"] == 10
+
+    write_config(mm, "interval: 15\n")
+    stat = os.stat(mm.config["config_file"])
+    os.utime(mm.config["config_file"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert mm.load_config()["interval"] == 15
+
+
+def test_packs_replace_and_clean(mm, tmp_path):
+    (tmp_path / "icons.yml").write_text("green: G\nnine: '9'\nbogus: x\n", encoding="utf-8")
+    (tmp_path / "txts.yml").write_text("- \"two\\nlines\"\n- Howdy\n- Howdy\n- ''\n", encoding="utf-8")
+    mm.config["pack_icons"] = str(tmp_path / "icons.yml")
+    mm.config["pack_txts"] = str(tmp_path / "txts.yml")
+
+    packs = mm.load_packs(mm.config)
+    assert packs["icon"]["green"] == "G"
+    assert packs["hops"][9] == "9"
+    assert packs["txts"] == ["two lines", "Howdy"]
+    assert mm.config["config_errors"] == ["icon pack has no icon named bogus"]
+
+    # second load comes from state_packs
+    assert mm.load_packs(mm.config)["txts"] == ["two lines", "Howdy"]
+
+
+def test_telemetry_pack_takes_only_requestable_types(mm, tmp_path):
+    assert mm.load_telemetry() == list(mm.TELEMETRY_TYPES)
+
+    (tmp_path / "telemetry.yml").write_text("- power\n- gps\n- device\n", encoding="utf-8")
+    problems = []
+    assert mm.load_telemetry(str(tmp_path / "telemetry.yml"), problems) == ["power", "device"]
+    assert problems == [f"unknown telemetry type gps, choose from {', '.join(mm.TELEMETRY_TYPES)}"]
+
+
+def test_txts_fit_in_a_packet(mm):
+    assert len(mm.clean_txt("é" * 500).encode("utf-8")) <= mm.TXT_MAX_BYTES
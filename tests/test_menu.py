@@ -0,0 +1,212 @@
+"""Menu output for the NodeDB fixtures, compared to golden files.
+
+Regenerate the golden files after an intended change with UPDATE_GOLDEN=1 and review the diff.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from conftest import FROZEN, load_nodes
+
+GOLDEN = Path(__file__).resolve().parent / "golden"
+
+OUTPUTS = {"xbar": "txt", "argos": "txt", "text": "txt", "json": "json"}
+
+
+def render(mm, output: str) -> str:
+    # commands call the plugin by absolute path, which depends on the checkout
+    return mm.RENDERERS[output]().render(mm.menu).replace(os.path.abspath(mm.__file__), "PLUGIN")
+
+
+def check_golden(name: str, text: str):
+    golden = GOLDEN / name
+    if os.environ.get("UPDATE_GOLDEN"):
+        golden.write_text(text, encoding="utf-8")
+    assert text == golden.read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("output", OUTPUTS)
+def test_nodes_golden(mm, output):
+    mm.print_menu_nodes(load_nodes("nodes-wifi"))
+    check_golden(f"nodes-wifi.{output}.{OUTPUTS[output]}", render(mm, output))
+
+
+def with_stores(mm, nodes: dict) -> dict:
+    """Geo, history, forecast and packet counters built from four hourly refreshes of nodes, newest last"""
+
+    geo, history, forecast = mm.GeoIndex(mm.config), mm.History(mm.config), mm.Forecast(mm.config)
+    for hours in (3, 2, 1, 0):
+        refresh = json.loads(json.dumps(nodes))
+        for node in refresh.values():
+            if node.get("lastHeard"):
+                node["lastHeard"] -= hours * 3600
+            metrics = node.get("deviceMetrics") or {}
+            if metrics.get("batteryLevel") is not None and metrics["batteryLevel"] <= 100:
+                metrics["batteryLevel"] += hours * 2
+            if metrics.get("channelUtilization") is not None:
+                metrics["channelUtilization"] += hours
+        geo.update(refresh, me="!a1b2c3d4")
+        history.update(refresh)
+        forecast.update(refresh)
+
+    tap = mm.PacketTap(mm.config)
+    t = int(FROZEN.timestamp())
+    for i, port in enumerate(("TEXT_MESSAGE_APP", "POSITION_APP", "TELEMETRY_APP")):
+        tap.on_receive({"id": i, "fromId": "!0badf00d", "toId": "^all", "rxTime": t - i * 60, "decoded": {"portnum": port}})
+    return {"packet_stats": tap.stats, "geo": geo, "history": history, "forecast": forecast}
+
+
+@pytest.mark.parametrize("output", OUTPUTS)
+def test_nodes_with_stores_golden(mm, output):
+    # wide enough for the fixture nodes to be each other's neighbours
+    mm.config["geo_radius"] = 15000
+    nodes = load_nodes("nodes-wifi")
+    mm.print_menu_nodes(nodes, **with_stores(mm, nodes))
+    check_golden(f"nodes-wifi-stores.{output}.{OUTPUTS[output]}", render(mm, output))
+
+
+def test_stores_fill_their_submenus(mm):
+    nodes = load_nodes("nodes-wifi")
+    mm.print_menu_nodes(nodes, **with_stores(mm, nodes))
+    titles = [title for depth, title, params in mm.menu]
+    assert f"{mm.icon['telescope']} History" in titles
+    assert any(title.startswith("Distance: ") for title in titles)
+    assert any(title.startswith("Nearby: ") for title in titles)
+    assert any(title.startswith("Runway: ") and "%/h" in title for title in titles)
+
+
+@pytest.mark.parametrize("output", OUTPUTS)
+def test_prepared_pack_texts_render_the_same(mm, monkeypatch, output):
+    tricky = "it's a | <b>\"quote\"</b> & more"
+    mm.print_menu_nodes(load_nodes("nodes-wifi"))
+    mm.menu_command(tricky, 1, "send", "^all", tricky)
+    plain = render(mm, output)
+
+    for renderer in mm.RENDERERS.values():
+        monkeypatch.setattr(renderer, "ready_titles", {})
+        monkeypatch.setattr(renderer, "ready_values", {})
+    mm.prepare_renderers({"txts": mm.txts + [tricky], "telemetry": mm.telemetry_types})
+    assert mm.RENDERERS[output].ready_titles[tricky]
+    assert render(mm, output) == plain
+
+
+def test_swiftbar_matches_xbar(mm):
+    mm.print_menu_nodes(load_nodes("nodes-wifi"))
+    assert render(mm, "swiftbar") == render(mm, "xbar")
+
+
+def test_first_node_is_ours_and_rest_sorted_by_heard(mm):
+    mm.print_menu_nodes(load_nodes("nodes-wifi"))
+    top = [title for depth, title, params in mm.menu if depth == 0 and title.startswith(("🌐", "🟢", "🟡", "🟠", "🔴", "🟣", "🔵", "⚫"))]
+    assert top[0].startswith("🌐 !a1b2c3d4")
+    assert [title.split()[1] for title in top[1:]] == ["!0badf00d", "!5e5e5e5e", "!77aa8899", "!12345678", "!deadbeef", "!00c0ffee"]
+
+
+def test_node_views_reorder_and_drop(mm):
+    mm.config["views"]["node"] = ["comms", "heard"]
+    mm.print_menu_nodes({"!0badf00d": load_nodes("nodes-wifi")["!0badf00d"]})
+    titles = [title for depth, title, params in mm.menu if depth == 1]
+    assert titles.index(f"{mm.icon['satellite']} Comms") < titles.index(f"{mm.icon['satdish']} Heard")
+    assert f"{mm.icon['ticket']} User" not in titles
+
+
+@pytest.mark.parametrize(
+    "hops, expected",
+    [(0, "zero"), (3, "three"), (9, "nine"), (10, "star"), (None, "star"), (-1, "star")],
+)
+def test_hops_icon(mm, hops, expected):
+    assert mm.get_node_hops_icon({"hopsAway": hops}) == mm.icon[expected]
+
+
+TIERS = ("green", "yellow", "orange", "red", "purple", "blue", "black")
+
+
+@pytest.mark.parametrize(
+    "ago, tier",
+    [(0, "green"), (3599, "green"), (3600, "yellow"), (4 * 3600, "orange"), (13 * 3600, "red"), (5 * 86400, "purple"), (9 * 86400, "blue")],
+)
+def test_heard_tier(mm, ago, tier):
+    assert mm.heard_tier(int(mm.ts.timestamp()) - ago) == tier
+
+
+def test_heard_tier_without_timestamp(mm):
+    assert mm.heard_tier(None) == "black"
+
+
+def test_heard_tier_with_one_glyph_for_every_tier(mm, monkeypatch):
+    monkeypatch.setattr(mm, "icon", {**mm.icon, **{tier: "●" for tier in TIERS}})
+    heard = int(mm.ts.timestamp()) - 13 * 3600
+    assert mm.heard_tier(heard) == "red"
+    assert mm.calculate_heards(heard)[0] == "●"
+    assert mm.node_summary({"lastHeard": heard})["tier"] == "red"
+
+
+def test_xbar_escapes_titles_and_params(mm):
+    mm.menu_item("a | b\nc", 1, command=["/bin/echo", "it's", 'say "hi"'], terminal=False)
+    line = mm.MenuRenderer().render(mm.menu)
+    assert line == "--a ¦ b c | shell='/bin/echo' | param1=\"it's\" | param2='say \"hi\"' | terminal=false\n"
+
+
+def test_argos_escapes_markup_and_joins_command(mm):
+    mm.menu_item("<b> & | x", 0, command=["/bin/echo", "a|b"], refresh=True)
+    line = mm.ArgosRenderer().render(mm.menu)
+    assert line.startswith("&lt;b&gt; &amp; ¦ x | ")
+    assert "refresh=true" in line
+    # argos splits params at the last bar so none may be left after it
+    assert line.rindex("|") == line.index(" | ") + 1
+
+
+def test_json_nests_items_by_depth(mm):
+    mm.menu_item("top")
+    mm.menu_item("child", 1, href="http://x")
+    mm.menu_item("grandchild", 2)
+    mm.menu_item("---", 1)
+    mm.menu_item("next")
+    tree = json.loads(mm.JsonRenderer().render(mm.menu))
+    assert tree == [
+        {"title": "top", "items": [{"title": "child", "href": "http://x", "items": [{"title": "grandchild"}]}, {"separator": True}]},
+        {"title": "next"},
+    ]
+
+
+def test_empty_menu_renders_nothing(mm):
+    for renderer in mm.RENDERERS.values():
+        assert renderer().render([]) == ""
+
+
+def test_cli_without_device_still_renders(mm, monkeypatch):
+    monkeypatch.setattr(mm, "get_iface", lambda config, connection=None: None)
+    with pytest.raises(SystemExit):
+        mm.cli(mm.config)
+    titles = [title for depth, title, params in mm.menu]
+    assert "No connection method set" in titles
+    assert mm.TextRenderer().render(mm.menu)
+
+
+def test_cli_with_fake_interface(mm, monkeypatch):
+    nodes = load_nodes("nodes-wifi")
+
+    class FakeIface:
+        def __init__(self):
+            self.nodes = nodes
+
+        def getMyNodeInfo(self):
+            return nodes["!a1b2c3d4"]
+
+        def close(self):
+            pass
+
+    mm.config["enrich_deadline"] = 0
+    monkeypatch.setattr(mm, "get_iface", lambda config, connection=None: FakeIface())
+    monkeypatch.setattr(mm, "log_wifi_report", lambda config: None)
+    mm.cli(mm.config)
+
+    titles = [title for depth, title, params in mm.menu if depth == 0]
+    assert "Nodes: 7" in titles
+    assert any(title.startswith("🌐 !a1b2c3d4") for title in titles)
+    for renderer in mm.RENDERERS.values():
+        assert renderer().render(mm.menu)
+    assert (Path(mm.config["log_dir"]) / mm.config["log_nodes_csv"]).exists()
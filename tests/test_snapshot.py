@@ -0,0 +1,89 @@
+"""The shared snapshot a listen collector publishes for menus and exporters"""
+
+import pytest
+
+from conftest import load_nodes, make_nodes
+
+
+@pytest.mark.parametrize(
+    "value",
+    [None, True, False, 0, -1, 2**63, -(2**40), 1.5, "", "é🟢", b"\x00\xff", [], [1, [2, "x"]], {"a": {"a": 1}}],
+)
+def test_encode_round_trip(mm, value):
+    assert mm.decode_value(mm.encode_value(value)) == value
+
+
+def test_encode_nodes_smaller_than_json(mm):
+    import json
+
+    nodes = make_nodes(1000)
+    buf = mm.encode_value(nodes)
+    assert mm.decode_value(buf) == nodes
+    assert len(buf) < len(json.dumps(nodes).encode())
+
+
+def test_reader_sees_published_nodes(mm):
+    nodes = load_nodes("nodes-wifi")
+    writer = mm.SharedSnapshot(mm.config).writer()
+    try:
+        assert mm.SharedSnapshot(mm.config).writer() is None
+        writer.publish({"me": {}, "nodes": {}})
+        writer.publish({"me": nodes["!a1b2c3d4"]["user"], "nodes": nodes})
+        # big enough to grow the file
+        writer.publish({"me": {}, "nodes": make_nodes(500)})
+        writer.publish({"me": nodes["!a1b2c3d4"]["user"], "nodes": nodes})
+        data = mm.SharedSnapshot(mm.config).read(max_age=60)
+        assert data == {"me": nodes["!a1b2c3d4"]["user"], "nodes": nodes}
+    finally:
+        writer.close()
+
+    # nothing is served once the collector is gone
+    assert mm.SharedSnapshot(mm.config).read() is None
+
+
+def test_cli_reads_snapshot_without_a_radio(mm, monkeypatch):
+    nodes = load_nodes("nodes-wifi")
+
+    def no_radio(config, connection=None):
+        raise AssertionError("connected to the radio while a collector is running")
+
+    monkeypatch.setattr(mm, "get_iface", no_radio)
+    monkeypatch.setattr(mm, "log_wifi_report", lambda config: None)
+    writer = mm.SharedSnapshot(mm.config).writer()
+    try:
+        writer.publish({"me": nodes["!a1b2c3d4"]["user"], "nodes": nodes})
+        mm.cli(mm.config)
+    finally:
+        writer.close()
+
+    assert "Nodes: 7" in [title for depth, title, params in mm.menu if depth == 0]
+
+
+def test_publish_retries_a_nodedb_changing_underneath(mm):
+    from test_collector import FakeRadio
+
+    class Growing(dict):
+        """A NodeDB the reader thread adds a node to while we copy it, once"""
+
+        grown = False
+
+        def items(self):
+            if not self.grown:
+                self.grown = True
+                raise RuntimeError("dictionary changed size during iteration")
+            return super().items()
+
+    nodes = load_nodes("nodes-wifi")
+    tap, stores = mm.collector_start(mm.config)
+    stores["snapshot"].add({"from": "!20000000", "t": int(mm.time.time()), "position": {"latitude": 1.0}})
+    writer = mm.SharedSnapshot(mm.config).writer()
+    try:
+        with tap.lock:
+            mm.shared_publish(writer, FakeRadio(Growing(nodes)), stores)
+        data = mm.SharedSnapshot(mm.config).read()
+    finally:
+        writer.close()
+        tap.close()
+
+    assert data["nodes"].keys() == nodes.keys() | {"!20000000"}
+    assert sorted(data["present"]) == sorted(nodes)
@@ -0,0 +1,251 @@
+"""Stores that build on each refresh's snapshot: alerts, geo index, history, forecast and the map"""
+
+from conftest import FROZEN, load_nodes
+
+
+def test_vanished_is_judged_on_the_radio_nodedb(mm):
+    nodes = load_nodes("nodes-wifi")
+    alerts = mm.Alerts(mm.config)
+    alerts.update(nodes, present=list(nodes))
+    alerts.save()
+
+    # the radio dropped a node but the snapshot cache still fills it into the merged view
+    alerts = mm.Alerts(mm.config)
+    alerts.update(nodes, present=[id for id in nodes if id != "!deadbeef"])
+    assert [(alert["node"], alert["text"]) for alert in alerts.new] == [("!deadbeef", "Vanished")]
+
+
+def test_map_rebuilds_only_changed_features(mm, monkeypatch):
+    nodes = load_nodes("nodes-wifi")
+    mesh_map = mm.MapExport(mm.config)
+    assert mesh_map.update(nodes)
+    mesh_map.write()
+    mesh_map.save()
+    placed = set(mesh_map.features)
+    assert placed and placed <= set(nodes)
+
+    mesh_map = mm.MapExport(mm.config)
+    assert not mesh_map.update(nodes)
+
+    # only the moved node gets a new feature
+    cached = dict(mesh_map.features)
+    id = sorted(placed)[0]
+    nodes[id]["position"]["latitude"] += 0.01
+    assert mesh_map.update(nodes)
+    assert [id for id in placed if mesh_map.features[id] != cached[id]] == [id]
+
+
+def test_map_is_written_again_when_its_file_is_gone(mm):
+    nodes = load_nodes("nodes-wifi")
+    mesh_map = mm.MapExport(mm.config)
+    mesh_map.update(nodes)
+    mesh_map.write()
+    mesh_map.save()
+
+    html = mm.os.path.join(mm.config["log_dir"], mm.config["map_html"])
+    mm.os.remove(html)
+    assert mm.MapExport(mm.config).update(nodes)
+
+
+def node_at(lat, lon, **node):
+    return {"position": {"latitude": lat, "longitude": lon}, **node}
+
+
+def test_geo_nearby_only_within_radius(mm):
+    mm.config["geo_radius"] = 3000
+    geo = mm.GeoIndex(mm.config)
+    nodes = {
+        "!00000001": node_at(37.7749, -122.4194),
+        "!00000002": node_at(37.7800, -122.4194),
+        "!00000003": node_at(37.8000, -122.4194),
+        "!00000004": node_at(38.5000, -122.4194),
+    }
+    geo.update(nodes, me="!00000001")
+
+    nearby = geo.nearby("!00000001")
+    assert [id for distance, id in nearby] == ["!00000002", "!00000003"]
+    assert 560 < nearby[0][0] < 580
+    assert geo.nearby("!00000009") == []
+    assert mm.compass(geo.distances["!00000003"][1]) == "N"
+
+    # a moved node is re-indexed and shows up in the lists around where it went
+    geo.dirty = False
+    nodes["!00000004"] = node_at(37.7760, -122.4194)
+    geo.update(nodes, me="!00000001")
+    assert geo.dirty
+    assert [id for distance, id in geo.nearby("!00000001")][0] == "!00000004"
+    assert [id for distance, id in geo.nearby("!00000003")] == ["!00000002", "!00000004", "!00000001"]
+
+
+def test_geo_forgets_nodes_that_left_the_nodedb(mm):
+    mm.config["geo_radius"] = 3000
+    geo = mm.GeoIndex(mm.config)
+    nodes = {"!00000001": node_at(37.7749, -122.4194), "!00000002": node_at(37.7800, -122.4194)}
+    geo.update(nodes, me="!00000001")
+    geo.save()
+
+    del nodes["!00000002"]
+    geo = mm.GeoIndex(mm.config)
+    geo.update(nodes, me="!00000001")
+    assert geo.dirty
+    assert list(geo.positions) == list(geo.distances) == list(geo.near) == ["!00000001"]
+    assert geo.nearby("!00000001") == []
+
+
+def test_geo_cached_lists_match_a_full_search(mm):
+    """Random moves and departures in a dense cluster, the incrementally kept lists must equal brute force"""
+
+    import random
+
+    mm.config["geo_radius"] = 2000
+    mm.config["geo_nearby_show"] = 3
+    rng = random.Random(7)
+
+    def spot():
+        return node_at(37.77 + rng.uniform(-0.03, 0.03), -122.42 + rng.uniform(-0.03, 0.03))
+
+    nodes = {f"!{i:08x}": spot() for i in range(60)}
+    geo = mm.GeoIndex(mm.config)
+    geo.update(nodes)
+    for refresh in range(15):
+        for id in rng.sample(sorted(nodes), 6):
+            nodes[id] = spot()
+        nodes.pop(rng.choice(sorted(nodes)))
+        nodes[f"!{100 + refresh:08x}"] = spot()
+        geo.save()
+        geo = mm.GeoIndex(mm.config)
+        geo.update(nodes)
+
+        for id in nodes:
+            lat, lon = (nodes[id]["position"][key] for key in ("latitude", "longitude"))
+            others = [other for other in nodes if other != id]
+            points = [(nodes[other]["position"]["latitude"], nodes[other]["position"]["longitude"]) for other in others]
+            full = sorted(
+                [round(distance, 1), other]
+                for other, (distance, bearing) in zip(others, mm.haversine_from(lat, lon, points))
+                if distance <= 2000
+            )
+            assert geo.nearby(id) == full[:4], id
+
+
+def test_geo_survives_a_save(mm):
+    mm.config["geo_radius"] = 500
+    geo = mm.GeoIndex(mm.config)
+    geo.update({"!00000001": node_at(1.0, 2.0), "!00000002": node_at(1.001, 2.0)}, me="!00000001")
+    geo.save()
+    assert [id for distance, id in mm.GeoIndex(mm.config).nearby("!00000001")] == ["!00000002"]
+
+    # a different radius throws the cached lists away
+    mm.config["geo_radius"] = 50
+    assert mm.GeoIndex(mm.config).nearby("!00000001") == []
+
+
+def metrics_node(battery, heard=None):
+    return {"lastHeard": heard or int(FROZEN.timestamp()), "deviceMetrics": {"batteryLevel": battery}}
+
+
+def test_alerts_fire_on_crossing_once_per_debounce(mm, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(mm.time, "time", lambda: now[0])
+    alerts = mm.Alerts(mm.config)
+
+    alerts.update({"!0badf00d": metrics_node(50)})
+    assert alerts.new == []
+
+    alerts.update({"!0badf00d": metrics_node(19)})
+    alerts.update({"!0badf00d": metrics_node(15)})
+    assert [alert["text"] for alert in alerts.new] == ["batteryLevel 50 > 19"]
+
+    # climbing back over and crossing again inside alert_debounce stays quiet
+    alerts.update({"!0badf00d": metrics_node(30)})
+    alerts.update({"!0badf00d": metrics_node(10)})
+    assert len(alerts.new) == 1
+
+    now[0] += mm.config["alert_debounce"] + 1
+    alerts.update({"!0badf00d": metrics_node(30)})
+    alerts.update({"!0badf00d": metrics_node(10)})
+    assert [alert["text"] for alert in alerts.new][1:] == ["batteryLevel 30 > 10"]
+    assert alerts.recent() == 2
+
+
+def test_menubar_count_includes_this_runs_alerts(mm, monkeypatch):
+    nodes = load_nodes("nodes-wifi")
+    monkeypatch.setattr(mm, "log_wifi_report", lambda config: None)
+    writer = mm.SharedSnapshot(mm.config).writer()
+    try:
+        writer.publish({"me": nodes["!a1b2c3d4"]["user"], "present": list(nodes), "nodes": nodes})
+        mm.cli(mm.config)
+        assert mm.menu[0][1] == ""
+
+        mm.menu.clear()
+        nodes["!0000abcd"] = {"num": 0xABCD, "lastHeard": int(FROZEN.timestamp())}
+        writer.publish({"me": nodes["!a1b2c3d4"]["user"], "present": list(nodes), "nodes": nodes})
+        mm.cli(mm.config)
+    finally:
+        writer.close()
+    assert mm.menu[0][1] == "1"
+    assert "image" in mm.menu[0][2]
+
+
+def test_alerts_new_node_and_tier(mm):
+    old = int(FROZEN.timestamp()) - 13 * 3600
+    alerts = mm.Alerts(mm.config)
+    alerts.update({"!0badf00d": {"lastHeard": old + 2 * 3600}})
+    alerts.update({"!0badf00d": {"lastHeard": old}, "!5e5e5e5e": {}})
+    assert sorted((alert["node"], alert["text"]) for alert in alerts.new) == [("!0badf00d", "tier orange > red"), ("!5e5e5e5e", "New node")]
+
+
+def test_history_ring_and_persistence(mm):
+    mm.config["history_size"] = 3
+    history = mm.History(mm.config)
+    for i in range(5):
+        history.update({"!0badf00d": {"lastHeard": 100 + i, "snr": float(i), "deviceMetrics": {"voltage": 4.0 - i / 10}}})
+    # the same reading again is not a new sample
+    history.update({"!0badf00d": {"lastHeard": 104, "snr": 9.0}})
+    assert history.series("!0badf00d", "snr") == [(102, 2.0), (103, 3.0), (104, 4.0)]
+    history.save()
+
+    again = mm.History(mm.config)
+    assert again.series("!0badf00d", "snr") == [(102, 2.0), (103, 3.0), (104, 4.0)]
+    assert [round(v, 2) for t, v in again.series("!0badf00d", "voltage")] == [3.8, 3.7, 3.6]
+    assert again.series("!0badf00d", "batteryLevel") == []
+
+    # a different size starts over rather than misreading the file
+    mm.config["history_size"] = 4
+    assert mm.History(mm.config).nodes == {}
+
+
+def test_forecast_slope_and_runway(mm):
+    forecast = mm.Forecast(mm.config)
+    for hour, level in enumerate((80, 78, 76, 74)):
+        forecast.add("!0badf00d", hour * 3600, "level", level)
+    assert round(forecast.slope("!0badf00d"), 6) == -2.0
+    assert round(forecast.runway("!0badf00d")) == 37 * 3600
+    assert forecast.status("!0badf00d") == "1d 13h (-2.00%/h)"
+    assert forecast.lowest(5) == [(forecast.runway("!0badf00d"), "!0badf00d")]
+
+
+def test_forecast_starts_over_when_charging(mm):
+    forecast = mm.Forecast(mm.config)
+    for hour, level in enumerate((80, 78, 76, 90)):
+        forecast.add("!0badf00d", hour * 3600, "level", level)
+    assert forecast.status("!0badf00d") == "Charging"
+    assert forecast.runway("!0badf00d") is None
+
+    # discharging again clears the flag, the fit only covers samples since the charge
+    for hour, level in enumerate((89, 88, 87), start=4):
+        forecast.add("!0badf00d", hour * 3600, "level", level)
+    assert not forecast.nodes["!0badf00d"]["charging"]
+    assert round(forecast.slope("!0badf00d"), 6) == -1.0
+
+    forecast.add("!0badf00d", 8 * 3600, "level", 101)
+    assert forecast.status("!0badf00d") == "Powered"
+
+
+def test_forecast_drops_samples_outside_the_window(mm):
+    mm.config["forecast_window"] = 3 * 3600
+    forecast = mm.Forecast(mm.config)
+    for hour, level in enumerate((100, 60, 58, 56, 54)):
+        forecast.add("!0badf00d", hour * 3600, "level", level)
+    assert [t for t, value in forecast.nodes["!0badf00d"]["samples"]] == [3600, 7200, 10800, 14400]
+    assert round(forecast.slope("!0badf00d"), 6) == -2.0